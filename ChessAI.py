@@ -1,107 +1,775 @@
 """
 Handling the AI moves.
 """
+import collections
+import ctypes
+import multiprocessing
+import os
+import pickle
+import queue
 import random
-
-piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-
-knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
-                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
-                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
-                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
-                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
-                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
-
-bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
-                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
-                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
-                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
-                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
-                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
-
-rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
-               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
-
-queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
-                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
-
-pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
-               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
-               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
-               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
-               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
-               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
-               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
-               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
-
-piece_position_scores = {"wN": knight_scores,
-                         "bN": knight_scores[::-1],
-                         "wB": bishop_scores,
-                         "bB": bishop_scores[::-1],
-                         "wQ": queen_scores,
-                         "bQ": queen_scores[::-1],
-                         "wR": rook_scores,
-                         "bR": rook_scores[::-1],
-                         "wp": pawn_scores,
-                         "bp": pawn_scores[::-1]}
+import sys
+import threading
+import time
+from array import array
+import ChessBitbase
+import ChessBook
+import ChessEngine
 
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 3
+BITBASE_WIN = CHECKMATE - 100  # score of a won bitbase position, less its distance to mate so faster wins score higher
+MAX_DEPTH = 32  # iterative deepening normally runs out of time long before this
+TIME_LIMIT = 3.0  # seconds per move, None for no time limit
+NODE_LIMIT = None  # nodes per move, None for no node limit
+HASH_SIZE_MB = 16  # memory cap of the transposition table
+DEBUG_EVALUATION = False  # check the incremental score against a full recompute at every evaluation
+DELTA_MARGIN = 2  # quiescence search skips captures that can't raise alpha even with this much extra
+NULL_MOVE_PRUNING = True  # a position still at least beta after passing the turn is cut off without a full search
+NULL_MOVE_REDUCTION = 2  # plies less that the search after the pass looks ahead
+NULL_MOVE_MIN_DEPTH = 3  # remaining depth below which no null move is tried
+LATE_MOVE_REDUCTIONS = True  # quiet moves ordered late are searched shallower first, and again in full if they look good
+LMR_FULL_DEPTH_MOVES = 3  # moves of every node searched at full depth before reductions start
+LMR_MIN_DEPTH = 3  # remaining depth below which nothing is reduced
+LMR_REDUCTION = 1  # plies taken off a late move
+FUTILITY_PRUNING = True  # near the leaves, quiet moves are skipped when the static score is hopelessly below alpha
+FUTILITY_MARGINS = (0, 1.5, 3.5)  # by remaining depth, how far a quiet move may still raise the static score
+RAZORING = False  # near the leaves, a static score far below alpha goes straight to the quiescence search,
+# off by default as it misses quiet mates the quiescence search never looks at
+RAZOR_MARGINS = (0, 3, 5)  # by remaining depth, how far below alpha the static score has to be
+NULL_WINDOW = 0.01  # width of the windows that only ask whether a score is above a bound, smaller than any score step
+WORKERS = 1  # processes searching every move together (Lazy SMP), 1 for a single-process search
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")  # Polyglot book, used if it exists
 
+# bound types of a score stored in the transposition table
+EXACT = 0
+LOWER_BOUND = 1  # the search failed high, the real score is at least the stored one
+UPPER_BOUND = 2  # no move raised alpha, the real score is at most the stored one
 
-def findBestMove(game_state, valid_moves, return_queue):
-    global next_move
-    next_move = None
+
+class TranspositionTable:
+    """
+    Fixed-size table of searched positions, indexed by the low bits of the Zobrist key.
+    Every entry takes 24 bytes in three flat arrays: the full key, the score, and one word packing
+    the best moveID + 1 (bits 0-13), depth (bits 14-21), bound type (bits 22-23) and search generation (bits 24-31).
+    An entry is replaced when it belongs to an older search or the new result is at least as deep.
+    """
+    ENTRY_SIZE = 24
+
+    def __init__(sky, size_mb=HASH_SIZE_MB):
+        entries = TranspositionTable.entriesFor(size_mb)
+        sky.mask = entries - 1
+        sky.keys = array("Q", bytes(8 * entries))
+        sky.scores = array("d", bytes(8 * entries))
+        sky.data = array("Q", bytes(8 * entries))
+        sky.generation = 1  # a stored entry always has a non-zero generation, an empty slot is all zeros
+
+    @staticmethod
+    def entriesFor(size_mb):
+        """
+        Largest power of two number of entries that fits in size_mb megabytes.
+        """
+        entries = 1
+        while entries * 2 * TranspositionTable.ENTRY_SIZE <= size_mb * 1024 * 1024:
+            entries *= 2
+        return entries
+
+    def newSearch(sky):
+        """
+        Start a new search, entries from previous searches become the first to be replaced.
+        """
+        sky.generation = sky.generation % 255 + 1
+
+    def clear(sky):
+        entries = sky.mask + 1
+        sky.keys = array("Q", bytes(8 * entries))
+        sky.scores = array("d", bytes(8 * entries))
+        sky.data = array("Q", bytes(8 * entries))
+
+    def probe(sky, key):
+        """
+        Return (depth, bound, score, move_id) stored for the position, or None.
+        move_id is None when no best move was stored.
+        """
+        index = key & sky.mask
+        data = sky.data[index]
+        if data == 0 or sky.keys[index] != key:
+            return None
+        move_id = (data & 0x3FFF) - 1
+        return (data >> 14) & 0xFF, (data >> 22) & 0x3, sky.scores[index], move_id if move_id >= 0 else None
+
+    def store(sky, key, depth, bound, score, move_id):
+        index = key & sky.mask
+        data = sky.data[index]
+        if data != 0 and sky.keys[index] != key and (data >> 24) == sky.generation and ((data >> 14) & 0xFF) > depth:
+            return  # keep the deeper entry of the current search
+        sky.keys[index] = key
+        sky.scores[index] = score
+        sky.data[index] = (0 if move_id is None else move_id + 1) | depth << 14 | bound << 22 | sky.generation << 24
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """
+    Transposition table in shared memory, searched by all the processes of a parallel search.
+    Processes write entries without locking, so the key array holds key ^ data ^ hash(score):
+    an entry torn by two processes writing the same slot at once fails the key check instead of being trusted.
+    Pass shared_arrays of an existing table to attach to it from another process.
+    """
+
+    def __init__(sky, size_mb=HASH_SIZE_MB, shared_arrays=None):
+        if shared_arrays is None:
+            entries = TranspositionTable.entriesFor(size_mb)
+            shared_arrays = (multiprocessing.RawArray("Q", entries), multiprocessing.RawArray("d", entries),
+                             multiprocessing.RawArray("Q", entries))
+        sky.shared_arrays = shared_arrays
+        sky.mask = len(shared_arrays[0]) - 1
+        sky.keys = memoryview(shared_arrays[0]).cast("B").cast("Q")
+        sky.scores = memoryview(shared_arrays[1]).cast("B").cast("d")
+        sky.data = memoryview(shared_arrays[2]).cast("B").cast("Q")
+        sky.generation = 1
+
+    def clear(sky):
+        for shared_array in sky.shared_arrays:
+            ctypes.memset(ctypes.addressof(shared_array), 0, ctypes.sizeof(shared_array))
+
+    def probe(sky, key):
+        index = key & sky.mask
+        data = sky.data[index]
+        score = sky.scores[index]
+        if data == 0 or sky.keys[index] ^ data ^ (hash(score) & 0xFFFFFFFFFFFFFFFF) != key:
+            return None
+        move_id = (data & 0x3FFF) - 1
+        return (data >> 14) & 0xFF, (data >> 22) & 0x3, score, move_id if move_id >= 0 else None
+
+    def store(sky, key, depth, bound, score, move_id):
+        index = key & sky.mask
+        data = sky.data[index]
+        stored_key = sky.keys[index] ^ data ^ (hash(sky.scores[index]) & 0xFFFFFFFFFFFFFFFF)
+        if data != 0 and stored_key != key and (data >> 24) == sky.generation and ((data >> 14) & 0xFF) > depth:
+            return  # keep the deeper entry of the current search
+        data = (0 if move_id is None else move_id + 1) | depth << 14 | bound << 22 | sky.generation << 24
+        sky.data[index] = data
+        sky.scores[index] = score
+        sky.keys[index] = key ^ data ^ (hash(score) & 0xFFFFFFFFFFFFFFFF)
+
+
+transposition_table = TranspositionTable()
+
+
+def setHashSize(size_mb):
+    """
+    Replace the transposition table with an empty one using at most size_mb megabytes.
+    """
+    global transposition_table
+    transposition_table = TranspositionTable(size_mb)
+
+
+opening_book = ChessBook.OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+
+
+def setBook(path):
+    """
+    Play from the Polyglot book at path while it has moves for the position, None for no book.
+    """
+    global opening_book
+    if opening_book is not None:
+        opening_book.close()
+    opening_book = ChessBook.OpeningBook(path) if path is not None else None
+
+
+# values used to order captures, most valuable victim first and least valuable attacker first among equal victims
+ordering_values = {"K": 20, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+
+
+class MoveOrderer:
+    """
+    Sorts the moves of a node so that the ones most likely to cause a beta cutoff are searched first:
+    the hash/PV move, then captures by MVV-LVA (and promotions), then the two killer moves of the ply,
+    then the remaining quiet moves by their history score.
+    Also counts how often the first move searched caused the cutoff, a measure of how good the ordering is.
+    """
+    HASH_MOVE_SCORE = 1000000
+    CAPTURE_SCORE = 100000
+    KILLER_SCORE = 90000
+    HISTORY_LIMIT = 80000  # history scores stay below the killers
+
+    def __init__(sky):
+        sky.killer_moves = [[None, None] for ply in range(MAX_DEPTH + 1)]
+        sky.history = [0] * 4096  # indexed by moveID
+        sky.cutoffs = 0
+        sky.first_move_cutoffs = 0
+
+    def newSearch(sky):
+        """
+        Forget the killers and age the history table so old results still count, but less.
+        """
+        sky.killer_moves = [[None, None] for ply in range(MAX_DEPTH + 1)]
+        sky.history = [score // 2 for score in sky.history]
+        sky.cutoffs = 0
+        sky.first_move_cutoffs = 0
+
+    def scoreMove(sky, move, hash_move_id, killers):
+        if move.moveID == hash_move_id:
+            return MoveOrderer.HASH_MOVE_SCORE
+        if move.piece_captured != "--" or move.is_pawn_promotion:
+            score = MoveOrderer.CAPTURE_SCORE
+            if move.piece_captured != "--":
+                score += 10 * ordering_values[move.piece_captured[1]] - ordering_values[move.piece_moved[1]]
+            if move.is_pawn_promotion:
+                score += 10 * ordering_values["Q"]
+            return score
+        if move.moveID == killers[0]:
+            return MoveOrderer.KILLER_SCORE
+        if move.moveID == killers[1]:
+            return MoveOrderer.KILLER_SCORE - 1
+        return min(sky.history[move.moveID], MoveOrderer.HISTORY_LIMIT)
+
+    def orderMoves(sky, moves, hash_move_id, ply):
+        """
+        Sort moves in place, best candidates first.
+        """
+        killers = sky.killer_moves[ply] if ply < len(sky.killer_moves) else (None, None)
+        moves.sort(key=lambda move: sky.scoreMove(move, hash_move_id, killers), reverse=True)
+
+    def recordCutoff(sky, move, depth, ply, move_index):
+        """
+        Remember a move that caused a beta cutoff. Quiet moves become killers of the ply and gain history.
+        """
+        sky.cutoffs += 1
+        if move_index == 0:
+            sky.first_move_cutoffs += 1
+        if move.piece_captured == "--" and not move.is_pawn_promotion:
+            if ply < len(sky.killer_moves):
+                killers = sky.killer_moves[ply]
+                if killers[0] != move.moveID:
+                    killers[1] = killers[0]
+                    killers[0] = move.moveID
+            sky.history[move.moveID] += depth * depth
+
+    def firstMoveCutoffRate(sky):
+        """
+        Fraction of beta cutoffs caused by the first move searched, 1.0 is perfect ordering.
+        """
+        return sky.first_move_cutoffs / sky.cutoffs if sky.cutoffs else 0.0
+
+
+move_orderer = MoveOrderer()
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time or node budget of the move is used up.
+    """
+
+
+# set in the helper processes of a parallel search, the search stops once it is set
+stop_event = None
+
+
+def findBestMove(game_state, valid_moves, return_queue, time_limit=TIME_LIMIT, node_limit=NODE_LIMIT,
+                 max_depth=MAX_DEPTH, report=None, start_depth=1):
+    """
+    Iterative deepening: search to depth start_depth, start_depth + 1, ... until the time or node budget runs out.
+    The best move of every finished depth is searched first at the next one.
+    A position in the opening book or in an endgame bitbase is not searched, its move is returned with depth 0.
+    Puts (best move, depth reached, seconds used) on the return_queue.
+    report, if given, is called after every finished depth with
+    (depth, score for the side to move, nodes so far, seconds so far, best move).
+    """
+    global next_move, search_depth, nodes, deadline, max_nodes, root_ply, pv_move_id
+    start_time = time.perf_counter()
+    deadline = None if time_limit is None else start_time + time_limit
+    max_nodes = node_limit
+    nodes = 0
+    if opening_book is not None:
+        book_move = opening_book.pickMove(game_state)
+        if book_move is not None:
+            return_queue.put((book_move, 0, time.perf_counter() - start_time))
+            return
+    if game_state.white_material + game_state.black_material <= ChessBitbase.max_material:
+        bitbase_move = ChessBitbase.bestMove(game_state)
+        if bitbase_move is not None:
+            return_queue.put((bitbase_move, 0, time.perf_counter() - start_time))
+            return
     random.shuffle(valid_moves)
-    findMoveNegaMaxAlphaBeta(game_state, valid_moves, DEPTH, -CHECKMATE, CHECKMATE,
-                             1 if game_state.white_to_move else -1)
-    return_queue.put(next_move)
+    transposition_table.newSearch()
+    move_orderer.newSearch()
+    best_move = valid_moves[0] if valid_moves else None  # something legal to play even if depth 1 does not finish
+    depth_reached = 0
+    root_ply = len(game_state.move_log)
+    pv_move_id = None
+    turn_multiplier = 1 if game_state.white_to_move else -1
+    for depth in range(start_depth, max_depth + 1):
+        next_move = None
+        search_depth = depth
+        try:
+            score = findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, -CHECKMATE, CHECKMATE, turn_multiplier)
+        except SearchTimeout:
+            while len(game_state.move_log) > root_ply:  # take back the moves of the interrupted line
+                game_state.undoMove()
+            if next_move is not None:  # the previous best move is searched first, so this one has beaten it
+                best_move = next_move
+            break
+        if next_move is not None:
+            best_move = next_move
+            pv_move_id = best_move.moveID
+        depth_reached = depth
+        if report is not None:
+            report(depth, score, nodes, time.perf_counter() - start_time, best_move)
+        if abs(score) >= CHECKMATE:  # a forced mate was found, searching deeper won't change the move
+            break
+    return_queue.put((best_move, depth_reached, time.perf_counter() - start_time))
+
+
+def findBestMoveParallel(game_state, valid_moves, return_queue, time_limit=TIME_LIMIT, node_limit=NODE_LIMIT,
+                         max_depth=MAX_DEPTH, report=None, workers=WORKERS):
+    """
+    Lazy SMP: workers - 1 helper processes search the same position as this one, all sharing one transposition table.
+    The helpers search the root moves in a different order and every other one starts a depth deeper, so they
+    fill the table with results this search then finds instead of searching them itself.
+    The result comes from this process alone and is put on return_queue as by findBestMove.
+    Afterwards helper_nodes holds the nodes searched by the helpers, for measuring the overhead.
+    """
+    global helper_nodes
+    helper_nodes = 0
+    if workers <= 1:
+        findBestMove(game_state, valid_moves, return_queue, time_limit, node_limit, max_depth, report)
+        return
+    pool = helperPool(workers)
+    pool.start(game_state, time_limit, max_depth)
+    try:
+        findBestMove(game_state, valid_moves, return_queue, time_limit, node_limit, max_depth, report)
+    finally:
+        helper_nodes = pool.finish()
+
+
+class HelperPool:
+    """
+    The helper processes of findBestMoveParallel and the shared transposition table they search with this process.
+    They wait between searches, so a search only sends them the position instead of starting processes and
+    allocating a table, and what they stored is still in the table for the next move.
+    """
+
+    def __init__(sky, workers, size_mb):
+        sky.workers = workers
+        sky.table = SharedTranspositionTable(size_mb)
+        sky.stop = multiprocessing.Event()
+        sky.results = multiprocessing.Queue()
+        sky.tasks = [multiprocessing.Queue() for helper_index in range(1, workers)]
+        sky.helpers = [multiprocessing.Process(target=helperLoop, daemon=True, args=(
+            sky.table.shared_arrays, sky.stop, tasks, sky.results, helper_index))
+            for helper_index, tasks in enumerate(sky.tasks, 1)]
+        for helper in sky.helpers:
+            helper.start()
+
+    def start(sky, game_state, time_limit, max_depth):
+        """
+        Set the helpers searching game_state. They use the table generation this process is about to start.
+        """
+        sky.stop.clear()
+        # pickled now: Queue.put pickles on a feeder thread, by then the search here is already changing game_state
+        position = pickle.dumps(game_state)
+        for tasks in sky.tasks:
+            tasks.put((position, sky.table.generation, time_limit, max_depth))
+
+    def finish(sky):
+        """
+        Stop the helpers and return the nodes they searched, once they all wait for the next search again.
+        """
+        sky.stop.set()
+        return sum(sky.results.get() for helper in sky.helpers)
+
+    def close(sky):
+        for tasks in sky.tasks:
+            tasks.put(None)
+        for helper in sky.helpers:
+            helper.join()
+
+
+helper_pool = None
 
 
-def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier):
+def helperPool(workers):
+    """
+    The helper pool for workers processes, started by the first parallel search and again when the number of
+    workers or the hash size changes. Its shared table is the transposition table of this process from then on,
+    a table replaced by setHashSize at the same size is taken as a request to empty it.
+    """
+    global helper_pool, transposition_table
+    if helper_pool is None or helper_pool.workers != workers or helper_pool.table.mask != transposition_table.mask:
+        if helper_pool is not None:
+            helper_pool.close()
+        helper_pool = HelperPool(workers, (transposition_table.mask + 1) * TranspositionTable.ENTRY_SIZE / 1024 / 1024)
+    elif transposition_table is not helper_pool.table:
+        helper_pool.table.clear()
+    transposition_table = helper_pool.table
+    return helper_pool
+
+
+def helperLoop(shared_arrays, stop, tasks, results, helper_index):
+    """
+    Body of a helper process of a HelperPool: search every position that arrives on tasks until stop is set,
+    then put the node count on results. None ends it.
+    """
+    global transposition_table, stop_event
+    transposition_table = SharedTranspositionTable(shared_arrays=shared_arrays)
+    stop_event = stop
+    random.seed(helper_index)  # each helper orders the root moves differently
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        position, generation, time_limit, max_depth = task
+        game_state = pickle.loads(position)
+        transposition_table.generation = generation  # findBestMove moves it on to the one of this search
+        findBestMove(game_state, game_state.getValidMoves(), queue.Queue(), time_limit, None, max_depth,
+                     start_depth=1 + helper_index % 2)
+        results.put(nodes)
+
+
+def expectedReply(game_state, move):
+    """
+    The reply to move that the transposition table holds as best, the second move of the principal variation,
+    or None. Used to ponder on the opponent's time.
+    """
+    game_state.makeMove(move)
+    entry = transposition_table.probe(game_state.zobrist_key)
+    reply = None
+    if entry is not None and entry[3] is not None:
+        reply = game_state.getMoveByID(entry[3])
+    game_state.undoMove()
+    return reply
+
+
+class SearchStats:
+    """
+    Counters of one search, filled in by searchWithStats.
+    """
+    # GameState methods whose calls are counted, the ones a state doesn't have are skipped
+    COUNTED_METHODS = ("getValidMoves", "getCaptureMoves", "getMoveByID", "checkForPinsAndChecks", "generateMoves",
+                       "squareUnderAttack")
+
+    def __init__(sky):
+        sky.nodes = 0
+        sky.quiescence_nodes = 0
+        sky.evaluations = 0
+        sky.hash_probes = 0
+        sky.hash_hits = 0
+        sky.cutoffs = 0
+        sky.first_move_cutoffs = 0
+        sky.method_calls = {}
+        sky.depths = []  # (depth, score, nodes, seconds, best move) of every finished depth
+        sky.time = 0.0
+
+    def recordDepth(sky, depth, score, nodes, elapsed, move):
+        sky.depths.append((depth, score, nodes, elapsed, move.getLongNotation() if move is not None else None))
+
+    def asDict(sky):
+        return {"nodes": sky.nodes, "quiescence_nodes": sky.quiescence_nodes, "evaluations": sky.evaluations,
+                "hash_probes": sky.hash_probes, "hash_hits": sky.hash_hits, "cutoffs": sky.cutoffs,
+                "first_move_cutoff_rate": round(sky.first_move_cutoffs / sky.cutoffs, 3) if sky.cutoffs else 0.0,
+                "method_calls": sky.method_calls, "time": round(sky.time, 4),
+                "depths": [{"depth": depth, "score": score, "nodes": nodes, "time": round(elapsed, 4), "move": move}
+                           for depth, score, nodes, elapsed, move in sky.depths]}
+
+    def summary(sky):
+        stats = sky.asDict()
+        lines = ["nodes {nodes} (quiescence {quiescence_nodes}), evaluations {evaluations}, hash hits {hash_hits}/"
+                 "{hash_probes}, cutoffs {cutoffs} ({first_move_cutoff_rate:.0%} on the first move)".format(**stats),
+                 "calls: " + ", ".join(name + " " + str(calls) for name, calls in sky.method_calls.items())]
+        previous_time = 0.0
+        for depth, score, nodes, elapsed, move in sky.depths:
+            lines.append("depth {}: {} score {:.2f}, {} nodes, {:.3f}s".format(depth, move, score, nodes,
+                                                                             elapsed - previous_time))
+            previous_time = elapsed
+        return "\n".join(lines)
+
+
+def searchWithStats(game_state, valid_moves, time_limit=TIME_LIMIT, node_limit=NODE_LIMIT, max_depth=MAX_DEPTH):
+    """
+    Run findBestMove with counters switched on and return (best move, depth reached, SearchStats).
+    The counters are wrappers swapped in for this search only: for scoreBoard and quiescenceSearch, for the
+    transposition table probe and for the move generation methods of game_state.
+    A search without stats runs the plain functions and pays nothing for this.
+    """
+    global scoreBoard, quiescenceSearch
+    stats = SearchStats()
+    plain_score_board, plain_quiescence_search = scoreBoard, quiescenceSearch
+    plain_probe = transposition_table.probe
+
+    def countingScoreBoard(game_state):
+        stats.evaluations += 1
+        return plain_score_board(game_state)
+
+    def countingQuiescenceSearch(game_state, alpha, beta, turn_multiplier):
+        stats.quiescence_nodes += 1
+        return plain_quiescence_search(game_state, alpha, beta, turn_multiplier)
+
+    def countingProbe(key):
+        stats.hash_probes += 1
+        entry = plain_probe(key)
+        if entry is not None:
+            stats.hash_hits += 1
+        return entry
+
+    def countingMethod(name, method):
+        def countCall(*args):
+            stats.method_calls[name] += 1
+            return method(*args)
+        return countCall
+
+    counted_methods = [name for name in SearchStats.COUNTED_METHODS if hasattr(game_state, name)]
+    for name in counted_methods:
+        stats.method_calls[name] = 0
+        setattr(game_state, name, countingMethod(name, getattr(game_state, name)))
+    scoreBoard, quiescenceSearch = countingScoreBoard, countingQuiescenceSearch
+    transposition_table.probe = countingProbe
+    return_queue = queue.Queue()
+    try:
+        findBestMove(game_state, valid_moves, return_queue, time_limit, node_limit, max_depth, stats.recordDepth)
+    finally:
+        scoreBoard, quiescenceSearch = plain_score_board, plain_quiescence_search
+        del transposition_table.probe
+        for name in counted_methods:
+            delattr(game_state, name)
+    best_move, depth_reached, stats.time = return_queue.get()
+    stats.nodes = nodes
+    stats.cutoffs = move_orderer.cutoffs
+    stats.first_move_cutoffs = move_orderer.first_move_cutoffs
+    return best_move, depth_reached, stats
+
+
+class StackSampler:
+    """
+    Sampling profiler: a background thread records the call stack of the profiled thread every interval seconds.
+    write() saves the samples as collapsed stacks, one "outer;inner;leaf count" line per stack,
+    the input format of flamegraph.pl, speedscope and most other flame graph tools.
+    """
+
+    def __init__(sky, interval=0.001):
+        sky.interval = interval
+        sky.samples = collections.Counter()
+        sky.thread_id = None
+        sky.running = False
+        sky.thread = None
+
+    def start(sky):
+        sky.thread_id = threading.get_ident()
+        sky.running = True
+        sky.thread = threading.Thread(target=sky.run, daemon=True)
+        sky.thread.start()
+
+    def stop(sky):
+        sky.running = False
+        sky.thread.join()
+
+    def run(sky):
+        while sky.running:
+            frame = sys._current_frames().get(sky.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(os.path.basename(frame.f_code.co_filename) + ":" + frame.f_code.co_name)
+                frame = frame.f_back
+            if stack:
+                sky.samples[";".join(reversed(stack))] += 1
+            time.sleep(sky.interval)
+
+    def write(sky, path):
+        with open(path, "w") as profile_file:
+            for stack, count in sky.samples.most_common():
+                profile_file.write(stack + " " + str(count) + "\n")
+
+
+def profileSearch(game_state, valid_moves, path, time_limit=TIME_LIMIT, node_limit=NODE_LIMIT, max_depth=MAX_DEPTH):
+    """
+    Run one findBestMove under the StackSampler and write its collapsed stacks to path.
+    Returns (best move, depth reached, seconds used).
+    """
+    sampler = StackSampler()
+    return_queue = queue.Queue()
+    sampler.start()
+    try:
+        findBestMove(game_state, valid_moves, return_queue, time_limit, node_limit, max_depth)
+    finally:
+        sampler.stop()
+    sampler.write(path)
+    return return_queue.get()
+
+
+def countNode():
+    """
+    Count a searched node and stop the search once the time or node budget is used up.
+    """
+    global nodes
+    nodes += 1
+    if (deadline is not None and time.perf_counter() > deadline) or (max_nodes is not None and nodes > max_nodes):
+        raise SearchTimeout
+    if stop_event is not None and nodes & 1023 == 0 and stop_event.is_set():
+        raise SearchTimeout
+
+
+def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier, null_move_allowed=True):
+    """
+    valid_moves is only given at the root. Inner nodes generate their moves in stages (hash move, captures,
+    quiet moves) after the table lookup, so a cutoff never pays for moves it doesn't search.
+    Below the root the search is selective, see NULL_MOVE_PRUNING, LATE_MOVE_REDUCTIONS, FUTILITY_PRUNING and RAZORING.
+    """
     global next_move
+    root = depth == search_depth
+    if not root and (game_state.halfmove_clock >= 100 or game_state.isRepetition()):
+        return STALEMATE  # a position seen before is scored as the draw it leads to if repeated
+    if not root and game_state.white_material + game_state.black_material <= ChessBitbase.max_material:
+        bitbase_entry = ChessBitbase.probe(game_state)
+        if bitbase_entry is not None:  # the exact result, nothing to search
+            result, distance = bitbase_entry
+            if result == ChessBitbase.WIN:
+                return BITBASE_WIN - (distance or 0)
+            if result == ChessBitbase.LOSS:
+                return -BITBASE_WIN + (distance or 0)
+            return STALEMATE
     if depth == 0:
-        return turn_multiplier * scoreBoard(game_state)
-    # move ordering - implement later //TODO
+        return quiescenceSearch(game_state, alpha, beta, turn_multiplier)
+    countNode()
+    key = game_state.zobrist_key
+    original_alpha = alpha
+    entry = transposition_table.probe(key)
+    hash_move_id = None
+    if entry is not None:
+        entry_depth, bound, entry_score, hash_move_id = entry
+        if entry_depth >= depth and not root:  # the root always searches, it has to pick next_move
+            if bound == EXACT:
+                return entry_score
+            if bound == LOWER_BOUND and entry_score >= beta:
+                return entry_score
+            if bound == UPPER_BOUND and entry_score <= alpha:
+                return entry_score
+    if root and pv_move_id is not None:
+        hash_move_id = pv_move_id  # best move of the previous iteration
+
+    in_check = not root and game_state.inCheck()
+    static_score = None
+    # the selective search only prunes against real scores, never against a mate or bitbase bound
+    real_alpha = alpha > -BITBASE_WIN / 2
+    if not root and not in_check:
+        static_score = turn_multiplier * scoreBoard(game_state)
+        if RAZORING and real_alpha and depth < len(RAZOR_MARGINS) and static_score + RAZOR_MARGINS[depth] <= alpha:
+            score = quiescenceSearch(game_state, alpha, beta, turn_multiplier)
+            if score <= alpha:  # not even the captures get it back to alpha
+                return score
+        if NULL_MOVE_PRUNING and null_move_allowed and depth >= NULL_MOVE_MIN_DEPTH and \
+                beta < BITBASE_WIN / 2 and static_score >= beta and game_state.hasPieces():
+            null_ply = len(game_state.move_log)
+            game_state.makeNullMove()
+            try:
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, max(depth - 1 - NULL_MOVE_REDUCTION, 0),
+                                                  -beta, -beta + NULL_WINDOW, -turn_multiplier, False)
+            except SearchTimeout:
+                while len(game_state.move_log) > null_ply:
+                    game_state.undoMove()
+                raise
+            finally:
+                game_state.undoNullMove()
+            if score >= beta:  # even passing holds beta, a real move will too
+                return beta
+
+    ply = len(game_state.move_log) - root_ply
+    if valid_moves is not None:
+        move_orderer.orderMoves(valid_moves, hash_move_id, ply)
+        moves = valid_moves
+    else:
+        moves = game_state.getStagedMoves(hash_move_id, lambda stage: move_orderer.orderMoves(stage, None, ply))
+    futile = FUTILITY_PRUNING and static_score is not None and real_alpha and depth < len(FUTILITY_MARGINS) and \
+        static_score + FUTILITY_MARGINS[depth] <= alpha
+    reducing = LATE_MOVE_REDUCTIONS and not root and not in_check and depth >= LMR_MIN_DEPTH
     max_score = -CHECKMATE
-    for move in valid_moves:
+    best_move = None
+    legal_moves = 0
+    for move_index, move in enumerate(moves):
+        legal_moves += 1
+        quiet = move.piece_captured == "--" and not move.is_pawn_promotion
         game_state.makeMove(move)
-        next_moves = game_state.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(game_state, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
+        prune = futile and quiet and move_index > 0
+        reduce = reducing and quiet and move_index >= LMR_FULL_DEPTH_MOVES
+        if (prune or reduce) and game_state.inCheck():  # checks are searched in full
+            prune = reduce = False
+        if prune:
+            game_state.undoMove()
+            if static_score + FUTILITY_MARGINS[depth] > max_score:
+                max_score = static_score + FUTILITY_MARGINS[depth]  # the most the move was given credit for
+            continue
+        if reduce:
+            score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1 - LMR_REDUCTION, -alpha - NULL_WINDOW,
+                                              -alpha, -turn_multiplier)
+            if score > alpha:  # better than expected, look again at full depth
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier)
+        else:
+            score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier)
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            best_move = move
+            if root:
                 next_move = move
-        print(move,score)
         game_state.undoMove()
+        if max_score > alpha:
+            alpha = max_score
+        if alpha >= beta:
+            move_orderer.recordCutoff(move, depth, ply, move_index)
+            break
+
+    if legal_moves == 0 and valid_moves is None:  # no legal moves
+        max_score = -CHECKMATE if game_state.inCheck() else STALEMATE
+    if max_score <= original_alpha:
+        bound = UPPER_BOUND
+    elif max_score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    transposition_table.store(key, depth, bound, max_score, None if best_move is None else best_move.moveID)
+    return max_score
+
+
+def quiescenceSearch(game_state, alpha, beta, turn_multiplier):
+    """
+    Search captures only until the position is quiet, so the evaluation never stops in the middle of an exchange.
+    The side to move may "stand pat" on the static evaluation instead of capturing, unless it is in check.
+    """
+    countNode()
+    moves = game_state.getCaptureMoves()
+    in_check = game_state.in_check  # read it now, searching the moves below overwrites it
+    if in_check:  # every evasion has to be looked at, standing pat is not an option
+        moves = game_state.getValidMoves()
+        if len(moves) == 0:
+            return -CHECKMATE
+        max_score = -CHECKMATE
+    else:
+        max_score = turn_multiplier * scoreBoard(game_state)  # stand pat
+        if max_score >= beta:
+            return max_score
+        if max_score > alpha:
+            alpha = max_score
+    stand_pat = max_score
+    move_orderer.orderMoves(moves, None, len(game_state.move_log) - root_ply)
+    for move in moves:
+        # delta pruning: skip captures that can't raise alpha even if the captured piece comes for free
+        if not in_check and not move.is_pawn_promotion and \
+                stand_pat + ChessEngine.piece_score[move.piece_captured[1]] + DELTA_MARGIN <= alpha:
+            continue
+        game_state.makeMove(move)
+        score = -quiescenceSearch(game_state, -beta, -alpha, -turn_multiplier)
+        game_state.undoMove()
+        if score > max_score:
+            max_score = score
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
             break
-    
     return max_score
 
 
 def scoreBoard(game_state):
     """
     Score the board. A positive score is good for white, a negative score is good for black.
+    Material and piece-square totals are kept up to date by the GameState, so this is just a read.
     """
     if game_state.checkmate:
         if game_state.white_to_move:
@@ -110,21 +778,13 @@ def scoreBoard(game_state):
             return CHECKMATE  # COLONISER WINS
     elif game_state.stalemate:
         return STALEMATE
-    score = 0
-    for row in range(len(game_state.board)):
-        for col in range(len(game_state.board[row])):
-            piece = game_state.board[row][col]
-            if piece != "--":
-                piece_position_score = 0
-                if piece[1] != "K":
-                    piece_position_score = piece_position_scores[piece][row][col]
-                if piece[0] == "w":
-                    score += piece_score[piece[1]] + piece_position_score
-                if piece[0] == "b":
-                    score -= piece_score[piece[1]] + piece_position_score
-    print(score)                
-   
-
+    score = (game_state.white_material - game_state.black_material +
+             game_state.white_position_score - game_state.black_position_score)
+    if DEBUG_EVALUATION:
+        white_material, black_material, white_position_score, black_position_score = game_state.computeScores()
+        full_score = white_material - black_material + white_position_score - black_position_score
+        if abs(score - full_score) > 1e-9:
+            raise AssertionError("incremental score %s differs from full recompute %s" % (score, full_score))
     return score
 
 ### CANT FIGURE OUT BEST MOVE ###
@@ -0,0 +1,133 @@
+"""
+Batch analysis of the positions in a FEN or EPD file, one position per line.
+The positions are searched by a pool of ChessAI processes with a fixed budget each,
+and one JSON line per position is written back in the order of the file.
+
+    python ChessAnalysis.py positions.epd                       1 second per position on every core
+    python ChessAnalysis.py positions.fen --time 5 -o out.jsonl
+    python ChessAnalysis.py positions.epd --depth 4 --time 0 --processes 4
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import ChessAI
+import ChessBitboard
+import ChessEngine
+
+TIME_LIMIT = 1.0  # seconds per position
+QUEUE_PER_PROCESS = 4  # positions handed out per process ahead of the one whose result is written next
+
+
+def startWorker(hash_size_mb):
+    """
+    Every worker process has its own transposition table of hash_size_mb and searches without the opening book.
+    """
+    ChessAI.setHashSize(hash_size_mb)
+    ChessAI.setBook(None)
+
+
+def analysePosition(task):
+    """
+    Search one FEN/EPD line, given as (line number, line, time limit, node limit, max depth), and return its result.
+    """
+    line_number, line, time_limit, node_limit, max_depth = task
+    result = {"line": line_number}
+    # a line that doesn't parse or can't be played spoils only its own result
+    try:
+        fen, operations = ChessEngine.parseEPD(line)
+        game_state = ChessBitboard.BitboardGameState()
+        game_state.loadFEN(fen)
+        best_moves = [game_state.getMoveBySAN(san) for san in operations["bm"].split()] if "bm" in operations else None
+    except ValueError as error:
+        return {"line": line_number, "error": "invalid position: {} ({})".format(line, error)}
+    result["fen"] = fen
+    if "id" in operations:
+        result["id"] = operations["id"]
+    scores = []
+    return_queue = queue.Queue()
+    # a search that fails is an engine bug, it is reported apart from bad input and the batch goes on
+    try:
+        ChessAI.findBestMove(game_state, game_state.getValidMoves(), return_queue, time_limit, node_limit, max_depth,
+                             lambda depth, score, nodes, elapsed, move: scores.append(score))
+    except Exception as error:
+        result["error"] = "search failed: {}: {}".format(type(error).__name__, error)
+        return result
+    best_move, depth_reached, elapsed = return_queue.get()
+    result.update({"move": best_move.getLongNotation() if best_move is not None else None,
+                   "score": round(scores[-1], 2) if scores else None, "depth": depth_reached,
+                   "nodes": ChessAI.nodes, "time": round(elapsed, 4)})
+    if best_moves is not None:
+        result["solved"] = best_move is not None and best_move in best_moves
+    return result
+
+
+def analyseLines(lines, processes, time_limit=TIME_LIMIT, node_limit=None, max_depth=ChessAI.MAX_DEPTH,
+                 hash_size_mb=ChessAI.HASH_SIZE_MB):
+    """
+    Yield the result of every position in lines, in input order.
+    Lines are read only as results are written, at most QUEUE_PER_PROCESS per process ahead,
+    so memory use doesn't grow with the size of the file.
+    """
+    tasks = ((line_number, line.strip(), time_limit, node_limit, max_depth)
+             for line_number, line in enumerate(lines, 1) if line.strip() and not line.startswith("#"))
+    if processes <= 1:
+        startWorker(hash_size_mb)
+        for task in tasks:
+            yield analysePosition(task)
+        return
+    pending = collections.deque()
+    with multiprocessing.Pool(processes, startWorker, (hash_size_mb,)) as pool:
+        for task in tasks:
+            pending.append(pool.apply_async(analysePosition, (task,)))
+            if len(pending) >= processes * QUEUE_PER_PROCESS:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse every position of a FEN or EPD file.")
+    parser.add_argument("file", help="FEN/EPD file with one position per line, - for standard input")
+    parser.add_argument("-o", "--output", help="write the JSON lines here instead of standard output")
+    parser.add_argument("--time", type=float, default=TIME_LIMIT, help="seconds per position, 0 for no limit")
+    parser.add_argument("--nodes", type=int, help="nodes per position")
+    parser.add_argument("-d", "--depth", type=int, default=ChessAI.MAX_DEPTH, help="maximum search depth")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--hash", type=int, default=ChessAI.HASH_SIZE_MB, metavar="MB",
+                        help="transposition table size of every process")
+    args = parser.parse_args()
+    if not args.time and not args.nodes and args.depth == ChessAI.MAX_DEPTH:
+        parser.error("give at least one of --time, --nodes or --depth as the budget")
+
+    input_file = sys.stdin if args.file == "-" else open(args.file)
+    output_file = open(args.output, "w") if args.output else sys.stdout
+    start_time = time.perf_counter()
+    positions = solved = tactical = 0
+    try:
+        for result in analyseLines(input_file, args.processes, args.time or None, args.nodes, args.depth, args.hash):
+            output_file.write(json.dumps(result) + "\n")
+            output_file.flush()
+            positions += 1
+            if "solved" in result:
+                tactical += 1
+                solved += result["solved"]
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    elapsed = time.perf_counter() - start_time
+    summary = "{} positions in {:.1f}s, {:.2f} positions/s".format(positions, elapsed,
+                                                                 positions / elapsed if elapsed > 0 else 0)
+    if tactical:
+        summary += ", solved {}/{}".format(solved, tactical)
+    print(summary, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Search benchmark: runs ChessAI.findBestMove to a fixed depth on a set of middlegame, endgame and tactical positions
+and reports nodes, nodes per second, time to every depth, the move found and how many tactical positions were solved.
+
+    python ChessBench.py                               run the built-in positions to the default depth
+    python ChessBench.py --json results.json           also write the results as JSON, e.g. to keep as a baseline
+    python ChessBench.py --baseline results.json       fail if nodes/s dropped or fewer positions were solved
+    python ChessBench.py --epd tactics.epd -d 5        EPD positions instead, "bm" operations are checked
+    python ChessBench.py --workers 8                   also search in parallel, report speedup and node overhead
+    python ChessBench.py --stats --profile bench.folded   search counters per position and a flame graph profile
+    python ChessBench.py --no-null-move --no-lmr       switch selective search options off to measure each one
+"""
+import argparse
+import json
+import platform
+import queue
+import random
+import sys
+import time
+import ChessAI
+import ChessBitboard
+import ChessEngine
+
+# (category, EPD), the tactical positions are from the Win At Chess suite and carry the best move to find
+POSITIONS = [
+    ("middlegame", 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - id "kiwipete";'),
+    ("middlegame", 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - id "italian";'),
+    ("middlegame", 'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - id "two knights";'),
+    ("middlegame", 'r2q1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2Q1RK1 w - - id "queens gambit";'),
+    ("endgame", '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - id "rook ending";'),
+    ("endgame", '8/8/4k3/8/8/3K4/4P3/8 w - - id "king and pawn";'),
+    ("endgame", '8/5pk1/6p1/8/8/3B1PP1/6K1/8 w - - id "bishop ending";'),
+    ("endgame", '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - id "back rank";'),
+    ("tactical", '2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - bm Qg6; id "WAC.001";'),
+    ("tactical", 'r1bq2rk/pp3pbp/2p1p1pQ/7P/3P4/2PB1N2/PP3PPR/2KR4 w - - bm Qxh7+; id "WAC.004";'),
+    ("tactical", '5k2/6pp/p1qN4/1p1p4/3P4/2PKP2Q/PP3r2/3R4 b - - bm Qc4+; id "WAC.005";'),
+    ("tactical", '7k/p7/1R5K/6r1/6p1/6P1/8/8 w - - bm Rb7; id "WAC.006";'),
+    ("tactical", 'rnbqkb1r/pppp1ppp/8/4P3/6n1/7P/PPPNPPP1/R1BQKBNR b KQkq - bm Ne3; id "WAC.007";'),
+    ("tactical", 'r4q1k/p2bR1rp/2p2Q1N/5p2/5p2/2P5/PP3PPP/R5K1 w - - bm Rf7; id "WAC.008";'),
+    ("tactical", '3q1rk1/p4pp1/2pb3p/3p4/6Pr/1PNQ4/P1PB1PP1/4RRK1 b - - bm Bh2+; id "WAC.009";'),
+    ("tactical", '2br2k1/2q3rn/p2NppQ1/2p1P3/Pp5R/4P3/1P3PPP/3R2K1 w - - bm Rxh7; id "WAC.010";'),
+]
+DEFAULT_DEPTH = 4
+# command line switch of every selective search option, by its ChessAI setting
+SELECTIVE_OPTIONS = {"NULL_MOVE_PRUNING": "--no-null-move", "LATE_MOVE_REDUCTIONS": "--no-lmr",
+                     "FUTILITY_PRUNING": "--no-futility", "RAZORING": "--no-razoring"}
+TOLERANCE = 0.1  # a drop in nodes/s larger than this fraction of the baseline fails the run
+
+
+def benchPosition(category, epd, depth, hash_size_mb, workers=1, with_stats=False):
+    """
+    Search one position to the given depth from a fresh transposition table and return its result dictionary.
+    with_stats adds the counters of ChessAI.searchWithStats to the result.
+    With more than one worker the position is searched a second time by findBestMoveParallel,
+    and the result also gets the speedup in time to depth and the extra nodes searched by all workers together.
+    """
+    fen, operations = ChessEngine.parseEPD(epd)
+    game_state = ChessBitboard.BitboardGameState()
+    game_state.loadFEN(fen)
+    best_moves = [game_state.getMoveBySAN(san) for san in operations.get("bm", "").split()]
+    random.seed(0)  # findBestMove shuffles the root moves, keep the node counts repeatable
+    ChessAI.setBook(None)  # the search is measured, not the book
+    ChessAI.setHashSize(hash_size_mb)
+    ChessAI.move_orderer = ChessAI.MoveOrderer()
+    return_queue = queue.Queue()
+    if with_stats:
+        best_move, depth_reached, stats = ChessAI.searchWithStats(game_state, game_state.getValidMoves(),
+                                                                  None, None, depth)
+        elapsed = stats.time
+        depths = stats.asDict()["depths"]
+    else:
+        depths = []
+
+        def report(depth_done, score, nodes, seconds, move):
+            depths.append({"depth": depth_done, "score": score, "nodes": nodes, "time": round(seconds, 4),
+                           "move": move.getLongNotation()})
+
+        ChessAI.findBestMove(game_state, game_state.getValidMoves(), return_queue, None, None, depth, report)
+        best_move, depth_reached, elapsed = return_queue.get()
+    result = {"id": operations.get("id", fen), "category": category, "fen": fen,
+              "move": best_move.getLongNotation() if best_move is not None else None,
+              "depth": depth_reached, "nodes": ChessAI.nodes, "time": round(elapsed, 4),
+              "nps": round(ChessAI.nodes / elapsed) if elapsed > 0 else 0, "depths": depths}
+    if with_stats:
+        result["stats"] = stats.asDict()
+    if best_moves:
+        result["best_moves"] = [move.getLongNotation() for move in best_moves if move is not None]
+        result["solved"] = best_move in best_moves
+    if workers > 1:
+        random.seed(0)
+        ChessAI.setHashSize(hash_size_mb)
+        ChessAI.move_orderer = ChessAI.MoveOrderer()
+        game_state.loadFEN(fen)
+        ChessAI.findBestMoveParallel(game_state, game_state.getValidMoves(), return_queue, None, None, depth,
+                                     workers=workers)
+        parallel_move, parallel_depth, parallel_time = return_queue.get()
+        parallel_nodes = ChessAI.nodes + ChessAI.helper_nodes
+        result["parallel"] = {"workers": workers, "move": parallel_move.getLongNotation() if parallel_move else None,
+                              "nodes": parallel_nodes, "time": round(parallel_time, 4),
+                              "speedup": round(elapsed / parallel_time, 3) if parallel_time > 0 else 0,
+                              "overhead": round(parallel_nodes / result["nodes"] - 1, 3) if result["nodes"] else 0}
+    return result
+
+
+def runBench(positions, depth, hash_size_mb=ChessAI.HASH_SIZE_MB, workers=1, with_stats=False):
+    """
+    Search every (category, EPD) position, print a line per position and return the results with their totals.
+    """
+    results = []
+    for category, epd in positions:
+        result = benchPosition(category, epd, depth, hash_size_mb, workers, with_stats)
+        results.append(result)
+        line = "{:<14} {:<10} {:>5} {:>9} nodes {:>7.2f}s {:>7} nodes/s".format(
+            result["id"][:14], category, result["move"] or "-", result["nodes"], result["time"], result["nps"])
+        if "solved" in result:
+            line += "  solved" if result["solved"] else "  missed, best " + " ".join(result["best_moves"])
+        if "parallel" in result:
+            line += "  x{} {:.2f}s speedup {:.2f} overhead {:+.0%}".format(
+                workers, result["parallel"]["time"], result["parallel"]["speedup"], result["parallel"]["overhead"])
+        print(line, flush=True)
+        if with_stats:
+            stats = result["stats"]
+            print("    quiescence {quiescence_nodes}, evaluations {evaluations}, hash hits {hash_hits}/{hash_probes}, "
+                  "cutoffs {cutoffs} ({first_move_cutoff_rate:.0%} first move)".format(**stats))
+            print("    calls: " + ", ".join(name + " " + str(calls) for name, calls in stats["method_calls"].items()))
+    nodes = sum(result["nodes"] for result in results)
+    elapsed = sum(result["time"] for result in results)
+    tactical = [result for result in results if "solved" in result]
+    totals = {"positions": len(results), "nodes": nodes, "time": round(elapsed, 4),
+              "nps": round(nodes / elapsed) if elapsed > 0 else 0,
+              "solved": sum(result["solved"] for result in tactical), "tactical": len(tactical)}
+    if workers > 1:
+        parallel_nodes = sum(result["parallel"]["nodes"] for result in results)
+        parallel_time = sum(result["parallel"]["time"] for result in results)
+        totals["parallel"] = {"workers": workers, "nodes": parallel_nodes, "time": round(parallel_time, 4),
+                              "speedup": round(elapsed / parallel_time, 3) if parallel_time > 0 else 0,
+                              "overhead": round(parallel_nodes / nodes - 1, 3) if nodes else 0}
+    selective = {name: getattr(ChessAI, name) for name in SELECTIVE_OPTIONS}
+    return {"depth": depth, "python": platform.python_version(), "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "selective": selective, "totals": totals, "positions": results}
+
+
+def compareBaseline(bench, baseline, tolerance=TOLERANCE):
+    """
+    Print how the run compares with a saved one and return the list of regressions, empty if there are none.
+    """
+    totals, old_totals = bench["totals"], baseline["totals"]
+    print("nodes/s {} (baseline {}), nodes {} (baseline {}), solved {}/{} (baseline {}/{})".format(
+        totals["nps"], old_totals["nps"], totals["nodes"], old_totals["nodes"],
+        totals["solved"], totals["tactical"], old_totals["solved"], old_totals["tactical"]))
+    regressions = []
+    if totals["nps"] < old_totals["nps"] * (1 - tolerance):
+        regressions.append("nodes/s dropped by {:.1%}".format(1 - totals["nps"] / old_totals["nps"]))
+    if totals["solved"] < old_totals["solved"]:
+        regressions.append("{} fewer positions solved".format(old_totals["solved"] - totals["solved"]))
+    if bench["depth"] != baseline["depth"]:
+        print("note: baseline was searched to depth {}, this run to depth {}".format(baseline["depth"], bench["depth"]))
+    if bench["selective"] != baseline.get("selective", bench["selective"]):
+        print("note: baseline was searched with other selective search options: {}".format(baseline["selective"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the chess search.")
+    parser.add_argument("-d", "--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--epd", help="file with one EPD position per line instead of the built-in positions")
+    parser.add_argument("--hash", type=int, default=ChessAI.HASH_SIZE_MB, metavar="MB")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="also search every position with this many processes and compare")
+    parser.add_argument("--stats", action="store_true",
+                        help="count evaluations, hash hits, cutoffs and move generation calls (slows the search)")
+    parser.add_argument("--profile", metavar="FILE", help="write a sampling profile as collapsed stacks for a flame graph")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="allowed drop in nodes/s as a fraction of the baseline")
+    for name, switch in SELECTIVE_OPTIONS.items():
+        parser.add_argument(switch, dest=name, action="store_false", help="search without ChessAI." + name)
+    args = parser.parse_args()
+    for name in SELECTIVE_OPTIONS:
+        setattr(ChessAI, name, getattr(args, name) and getattr(ChessAI, name))
+
+    if args.epd:
+        with open(args.epd) as epd_file:
+            positions = [("epd", line.strip()) for line in epd_file if line.strip() and not line.startswith("#")]
+    else:
+        positions = POSITIONS
+    if args.profile:
+        sampler = ChessAI.StackSampler()
+        sampler.start()
+    bench = runBench(positions, args.depth, args.hash, args.workers, args.stats)
+    if args.profile:
+        sampler.stop()
+        sampler.write(args.profile)
+    totals = bench["totals"]
+    print("total: {} nodes in {:.2f}s, {} nodes/s, solved {}/{}".format(
+        totals["nodes"], totals["time"], totals["nps"], totals["solved"], totals["tactical"]))
+    if "parallel" in totals:
+        print("parallel: {} workers, {:.2f}s, speedup {:.2f}, node overhead {:+.0%}".format(
+            args.workers, totals["parallel"]["time"], totals["parallel"]["speedup"], totals["parallel"]["overhead"]))
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(bench, json_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compareBaseline(bench, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("REGRESSION: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Endgame bitbases: win/draw/loss and distance to mate of every position of a small ending, e.g. KRvK.
+Tables are made offline by retrograde analysis over the moves of ChessBitboard and stored bit-packed,
+2 bits of result per position plus one byte of distance to mate in plies, in a file that is read through mmap.
+A probe is an index computation and one or two byte reads.
+
+    python ChessBitbase.py                      generate all 3-man tables (KQvK, KRvK, KBvK, KNvK, KPvK)
+    python ChessBitbase.py KRvK --no-dtm        one table, results only
+
+A table is named after the pieces of the stronger side, "v", and the pieces of the other side.
+It is stored for white being the stronger side, the other colour is probed by flipping the board.
+Only 3-man endings are covered. A 4-man table has 33 million positions, its move graph would take
+several GB of memory and generating it in Python hours, so the command line doesn't offer them.
+"""
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+import ChessBitboard
+import ChessEngine
+
+BITBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases")
+MAX_MEN = 3  # most pieces, kings included, of a table; positions with more are never probed
+THREE_MAN = ("KQvK", "KRvK", "KBvK", "KNvK", "KPvK")
+MAGIC = b"CBB1"
+HEADER_SIZE = 8  # magic, number of pieces, flags, 2 bytes unused
+DTM_FLAG = 1
+
+# results for the side to move
+DRAW = 0
+WIN = 1
+LOSS = 2
+ILLEGAL = 3
+
+PIECE_ORDER = "KQRBNP"  # letters of a signature, in index order
+PIECE_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+PIECE_NAMES = {"K": "K", "Q": "Q", "R": "R", "B": "B", "N": "N", "P": "p"}  # letter -> piece name on the board
+
+
+def materialOf(signature):
+    return sum(PIECE_VALUES.get(piece, 0) for piece in signature)
+
+
+def canonicalSignature(signature):
+    """
+    Name of the table of an ending, the side with more material first: "KvKR" -> "KRvK".
+    """
+    white, black = signature.split("v")
+    white_value = (sum(PIECE_VALUES[piece] for piece in white), len(white), white)
+    black_value = (sum(PIECE_VALUES[piece] for piece in black), len(black), black)
+    return signature if white_value >= black_value else black + "v" + white
+
+
+def tablePieces(signature):
+    """
+    Pieces of a table in index order, e.g. ["wK", "wR", "bK"] for KRvK. Equal pieces come one after the other.
+    """
+    white, black = signature.split("v")
+    return ["w" + PIECE_NAMES[piece] for piece in sorted(white, key=PIECE_ORDER.index)] + \
+           ["b" + PIECE_NAMES[piece] for piece in sorted(black, key=PIECE_ORDER.index)]
+
+
+def pieceSquares(game_state):
+    """
+    {piece: [square, ...]} of the position with square = row * 8 + col, from the bitboards if there are any.
+    """
+    squares = {}
+    if hasattr(game_state, "bitboards"):
+        for piece, bitboard in game_state.bitboards.items():
+            if bitboard:
+                squares[piece] = list(ChessBitboard.squaresOf(bitboard))
+    else:
+        for row in range(8):
+            for col in range(8):
+                piece = game_state.board[row][col]
+                if piece != "--":
+                    squares.setdefault(piece, []).append(row * 8 + col)
+    return squares
+
+
+def signatureOf(squares):
+    white = "".join(piece * len(squares.get("w" + PIECE_NAMES[piece], ())) for piece in PIECE_ORDER)
+    black = "".join(piece * len(squares.get("b" + PIECE_NAMES[piece], ())) for piece in PIECE_ORDER)
+    return white + "v" + black
+
+
+def positionIndex(pieces, squares, white_to_move):
+    """
+    Index of a position in the table with the given pieces: the side to move, then one base-64 digit per piece.
+    """
+    index = 0 if white_to_move else 1
+    taken = {}
+    for piece in pieces:
+        used = taken.get(piece, 0)
+        index = index * 64 + squares[piece][used]
+        taken[piece] = used + 1
+    return index
+
+
+class Bitbase:
+    """
+    A table file mapped into memory.
+    """
+
+    def __init__(sky, path):
+        sky.file = open(path, "rb")
+        sky.data = mmap.mmap(sky.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if sky.data[:4] != MAGIC:
+            raise ValueError("not a bitbase file: " + path)
+        men, flags = sky.data[4], sky.data[5]
+        sky.positions = 2 * 64 ** men
+        sky.dtm_offset = HEADER_SIZE + (sky.positions + 3) // 4 if flags & DTM_FLAG else None
+
+    def value(sky, index):
+        """
+        (result, distance to mate in plies or None) of the position with this index.
+        """
+        result = (sky.data[HEADER_SIZE + (index >> 2)] >> ((index & 3) * 2)) & 3
+        if sky.dtm_offset is None or result == DRAW:
+            return result, None
+        return result, sky.data[sky.dtm_offset + index]
+
+    def close(sky):
+        sky.data.close()
+        sky.file.close()
+
+
+tables = {}  # signature -> Bitbase, or None for a table that isn't there
+bitbase_dir = BITBASE_DIR
+max_material = -1  # most material (by PIECE_VALUES) of a table in bitbase_dir, -1 without tables
+
+
+def setBitbaseDir(path):
+    """
+    Probe the tables in path from now on.
+    """
+    global bitbase_dir, max_material
+    for table in tables.values():
+        if table is not None:
+            table.close()
+    tables.clear()
+    bitbase_dir = path
+    max_material = -1
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            if name.endswith(".cbb"):
+                max_material = max(max_material, materialOf(name[:-4]))
+
+
+setBitbaseDir(BITBASE_DIR)
+
+
+def getTable(signature):
+    if signature not in tables:
+        path = os.path.join(bitbase_dir, signature + ".cbb")
+        tables[signature] = Bitbase(path) if os.path.exists(path) else None
+    return tables[signature]
+
+
+def probe(game_state):
+    """
+    (result, distance to mate in plies or None) for the side to move, or None when no table covers the position.
+    Positions with castling rights or a possible en-passant capture are not in any table.
+    """
+    rights = game_state.current_castling_rights
+    if rights.wks or rights.bks or rights.wqs or rights.bqs:
+        return None
+    if hasattr(game_state, "occupied") and bin(game_state.occupied["w"] | game_state.occupied["b"]).count("1") > MAX_MEN:
+        return None
+    squares = pieceSquares(game_state)
+    if sum(len(piece_squares) for piece_squares in squares.values()) > MAX_MEN:
+        return None
+    if game_state.enpassant_possible != () and (("wp" if game_state.white_to_move else "bp") in squares):
+        return None
+    signature = signatureOf(squares)
+    if signature == "KvK":
+        return DRAW, None
+    table_signature = canonicalSignature(signature)
+    table = getTable(table_signature)
+    if table is None:
+        return None
+    if table_signature == signature:
+        return table.value(positionIndex(tablePieces(signature), squares, game_state.white_to_move))
+    # the table has the other colour as the stronger side, look up the mirrored position
+    flipped = {("b" if piece[0] == "w" else "w") + piece[1]: sorted(square ^ 56 for square in piece_squares)
+               for piece, piece_squares in squares.items()}
+    return table.value(positionIndex(tablePieces(table_signature), flipped, not game_state.white_to_move))
+
+
+def bestMove(game_state):
+    """
+    The best move by the tables: the quickest win, else a draw, else the longest defence.
+    None when the position or one of its moves isn't covered or the table has no distances to mate.
+    """
+    root = probe(game_state)
+    if root is None or (root[0] != DRAW and root[1] is None):
+        return None
+    best_move = None
+    best_rank = None
+    for move in game_state.getValidMoves():
+        game_state.makeMove(move)
+        entry = probe(game_state)
+        game_state.undoMove()
+        if entry is None:
+            return None
+        result, dtm = entry
+        if result == LOSS:  # the opponent loses
+            rank = (2, -(dtm or 0))
+        elif result == DRAW:
+            rank = (1, 0)
+        else:
+            rank = (0, dtm or 0)
+        if best_rank is None or rank > best_rank:
+            best_move, best_rank = move, rank
+    return best_move
+
+
+def dependencies(signature):
+    """
+    Tables a capture or promotion out of this ending leads to.
+    """
+    white, black = signature.split("v")
+    results = set()
+    for side, other, white_side in ((white, black, True), (black, white, False)):
+        for index, piece in enumerate(side):
+            if piece == "K":
+                continue
+            changed = [side[:index] + side[index + 1:]]  # the piece is captured
+            if piece == "P":
+                changed.append(side[:index] + "Q" + side[index + 1:])  # the pawn promotes, always to a queen
+            for new_side in changed:
+                new_signature = new_side + "v" + other if white_side else other + "v" + new_side
+                white_part, black_part = new_signature.split("v")
+                new_signature = "".join(sorted(white_part, key=PIECE_ORDER.index)) + "v" + \
+                                "".join(sorted(black_part, key=PIECE_ORDER.index))
+                if new_signature != "KvK":
+                    results.add(canonicalSignature(new_signature))
+    return sorted(results)
+
+
+def generateBitbase(signature, with_dtm=True, log=print):
+    """
+    Generate the table of an ending and the tables it depends on, and write them to bitbase_dir.
+    Every position's legal moves are generated once into a move graph, then results spread backwards from the
+    mates: a position is won once a move reaches a lost position, and lost once every move reaches a won one.
+    Positions visited in order of distance to mate give every result its shortest mate (or longest defence).
+    """
+    global max_material
+    signature = canonicalSignature(signature)
+    for dependency in dependencies(signature):
+        if getTable(dependency) is None:
+            del tables[dependency]
+            generateBitbase(dependency, with_dtm, log)
+    start_time = time.perf_counter()
+    pieces = tablePieces(signature)
+    men = len(pieces)
+    positions = 2 * 64 ** men
+    result = bytearray(positions)  # 0 undecided, WIN, LOSS, ILLEGAL; undecided positions end up drawn
+    distance = bytearray(positions)
+    unresolved = array("H", bytes(2 * positions))  # moves of a position not yet known to lose
+    longest = bytearray(positions)  # longest distance of the won positions its moves reach
+    child_start = array("L", bytes(array("L").itemsize * (positions + 1)))
+    children = array("L")
+    buckets = [[] for ply in range(256)]  # (position, result) by distance to mate
+
+    game_state = ChessBitboard.BitboardGameState()
+    game_state.current_castling_rights = ChessEngine.CastleRights(False, False, False, False)
+    game_state.castle_rights_log = [ChessEngine.CastleRights(False, False, False, False)]
+    game_state.enpassant_possible = ()
+    game_state.enpassant_possible_log = [()]
+    for index in range(positions):
+        child_start[index] = len(children)
+        squares = []
+        rest = index
+        for piece in pieces:
+            squares.append(rest % 64)
+            rest //= 64
+        squares.reverse()
+        white_to_move = rest == 0
+        if len(set(squares)) < men or any(piece[1] == "p" and square // 8 in (0, 7)
+                                          for piece, square in zip(pieces, squares)):
+            result[index] = ILLEGAL
+            continue
+        board = [["--"] * 8 for row in range(8)]
+        for piece, square in zip(pieces, squares):
+            board[square // 8][square % 8] = piece
+            if piece == "wK":
+                game_state.white_king_location = (square // 8, square % 8)
+            elif piece == "bK":
+                game_state.black_king_location = (square // 8, square % 8)
+        game_state.board = board
+        game_state.white_to_move = white_to_move
+        game_state.loadBitboards()
+        enemy_king = game_state.black_king_location if white_to_move else game_state.white_king_location
+        mover = "w" if white_to_move else "b"
+        occupied = game_state.occupied["w"] | game_state.occupied["b"]
+        if game_state.attackersTo(enemy_king[0] * 8 + enemy_king[1], mover, occupied):
+            result[index] = ILLEGAL  # the side that just moved is in check
+            continue
+        moves = game_state.generateMoves()
+        if not moves:
+            if game_state.in_check:
+                buckets[0].append((index, LOSS))
+            continue  # stalemate stays undecided, a draw
+        open_moves = 0
+        for move in moves:
+            game_state.makeMove(move)
+            child_squares = pieceSquares(game_state)
+            if signatureOf(child_squares) == signature:
+                children.append(positionIndex(pieces, child_squares, game_state.white_to_move))
+                open_moves += 1
+            else:
+                child_result, child_distance = probe(game_state)
+                if child_result == LOSS:
+                    buckets[min(child_distance or 0, 254) + 1].append((index, WIN))
+                    open_moves += 1  # a won position never becomes lost, however its other moves turn out
+                elif child_result == WIN:
+                    longest[index] = max(longest[index], child_distance or 0)
+                else:
+                    open_moves += 1  # a draw never resolves
+            game_state.undoMove()
+        unresolved[index] = open_moves
+        if open_moves == 0:
+            buckets[min(longest[index], 254) + 1].append((index, LOSS))
+    child_start[positions] = len(children)
+    log("{}: move graph of {} positions built in {:.0f}s".format(signature, positions,
+                                                                 time.perf_counter() - start_time))
+
+    # reverse the graph, parents of every position
+    parent_start = array("L", bytes(array("L").itemsize * (positions + 1)))
+    for child in children:
+        parent_start[child + 1] += 1
+    for index in range(positions):
+        parent_start[index + 1] += parent_start[index]
+    parents = array("L", bytes(array("L").itemsize * len(children)))
+    filled = array("L", parent_start)
+    for index in range(positions):
+        for child_index in range(child_start[index], child_start[index + 1]):
+            child = children[child_index]
+            parents[filled[child]] = index
+            filled[child] += 1
+    del children, child_start, filled
+
+    for ply in range(256):
+        for index, position_result in buckets[ply]:
+            if result[index]:
+                continue
+            result[index] = position_result
+            distance[index] = ply
+            for parent_index in range(parent_start[index], parent_start[index + 1]):
+                parent = parents[parent_index]
+                if result[parent]:
+                    continue
+                if position_result == LOSS:
+                    buckets[min(ply + 1, 255)].append((parent, WIN))
+                else:
+                    unresolved[parent] -= 1
+                    longest[parent] = max(longest[parent], ply)
+                    if unresolved[parent] == 0:  # the longest defence may run into another table, longer than ply
+                        buckets[min(longest[parent] + 1, 255)].append((parent, LOSS))
+        buckets[ply] = None
+
+    packed = bytearray((positions + 3) // 4)
+    for index in range(positions):
+        packed[index >> 2] |= result[index] << ((index & 3) * 2)
+    os.makedirs(bitbase_dir, exist_ok=True)
+    with open(os.path.join(bitbase_dir, signature + ".cbb"), "wb") as table_file:
+        table_file.write(MAGIC + bytes((men, DTM_FLAG if with_dtm else 0, 0, 0)))
+        table_file.write(packed)
+        if with_dtm:
+            table_file.write(distance)
+    tables.pop(signature, None)
+    max_material = max(max_material, materialOf(signature))
+    log("{}: {} won, {} lost, {} drawn, longest mate {} plies, {:.0f}s".format(
+        signature, result.count(WIN), result.count(LOSS),
+        positions - result.count(WIN) - result.count(LOSS) - result.count(ILLEGAL),
+        max(distance), time.perf_counter() - start_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate endgame bitbases.")
+    parser.add_argument("signatures", nargs="*", default=THREE_MAN, help="endings to generate, e.g. KRvK")
+    parser.add_argument("--directory", default=BITBASE_DIR)
+    parser.add_argument("--no-dtm", action="store_true", help="store only win/draw/loss, no distance to mate")
+    args = parser.parse_args()
+    setBitbaseDir(args.directory)
+    for signature in args.signatures:
+        if len(signature.replace("v", "")) > MAX_MEN or signature.count("v") != 1 or \
+                not set(signature) <= set(PIECE_ORDER + "v") or signature.replace("v", "").count("K") != 2:
+            sys.exit("not an ending of at most {} pieces (kings included): {}".format(MAX_MEN, signature))
+        generateBitbase(signature, not args.no_dtm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Bitboard backend for the GameState.
+Every piece of every colour is kept as a 64-bit integer with one bit per square.
+The square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1, same as board[row][col].
+Knight, king and pawn attacks come from precomputed tables, sliding attacks from precomputed rays.
+"""
+import ChessEngine
+
+PIECES = ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")
+SQUARES = [(square // 8, square % 8) for square in range(64)]
+BITS = [1 << square for square in range(64)]
+FULL = (1 << 64) - 1
+
+
+def _onBoard(row, col):
+    return 0 <= row <= 7 and 0 <= col <= 7
+
+
+def _stepTable(offsets):
+    """
+    For every square, the set of squares reachable with one of the given (d_row, d_col) steps.
+    """
+    table = []
+    for row, col in SQUARES:
+        attacks = 0
+        for d_row, d_col in offsets:
+            if _onBoard(row + d_row, col + d_col):
+                attacks |= BITS[(row + d_row) * 8 + col + d_col]
+        table.append(attacks)
+    return table
+
+
+def _rayTable(direction):
+    """
+    For every square, the set of squares along the direction up to the edge of the board (square itself excluded).
+    """
+    table = []
+    for row, col in SQUARES:
+        ray = 0
+        end_row, end_col = row + direction[0], col + direction[1]
+        while _onBoard(end_row, end_col):
+            ray |= BITS[end_row * 8 + end_col]
+            end_row, end_col = end_row + direction[0], end_col + direction[1]
+        table.append(ray)
+    return table
+
+
+KNIGHT_ATTACKS = _stepTable(((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2)))
+KING_ATTACKS = _stepTable(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+PAWN_ATTACKS = {"w": _stepTable(((-1, -1), (-1, 1))), "b": _stepTable(((1, -1), (1, 1)))}
+
+# rays running towards lower square indices are named "negative", the first blocker on them is the highest set bit
+RAY_UP, RAY_LEFT, RAY_DOWN, RAY_RIGHT = (_rayTable(direction) for direction in ((-1, 0), (0, -1), (1, 0), (0, 1)))
+RAY_UP_LEFT, RAY_UP_RIGHT, RAY_DOWN_RIGHT, RAY_DOWN_LEFT = (_rayTable(direction) for direction in
+                                                            ((-1, -1), (-1, 1), (1, 1), (1, -1)))
+
+
+def _positiveRay(ray, square, occupied):
+    attacks = ray[square]
+    blockers = attacks & occupied
+    if blockers:
+        attacks ^= ray[(blockers & -blockers).bit_length() - 1]
+    return attacks
+
+
+def _negativeRay(ray, square, occupied):
+    attacks = ray[square]
+    blockers = attacks & occupied
+    if blockers:
+        attacks ^= ray[blockers.bit_length() - 1]
+    return attacks
+
+
+def rookAttacks(square, occupied):
+    """
+    Squares attacked by a rook on square, stopping at (and including) the first piece in each direction.
+    """
+    return (_negativeRay(RAY_UP, square, occupied) | _negativeRay(RAY_LEFT, square, occupied) |
+            _positiveRay(RAY_DOWN, square, occupied) | _positiveRay(RAY_RIGHT, square, occupied))
+
+
+def bishopAttacks(square, occupied):
+    """
+    Squares attacked by a bishop on square, stopping at (and including) the first piece in each direction.
+    """
+    return (_negativeRay(RAY_UP_LEFT, square, occupied) | _negativeRay(RAY_UP_RIGHT, square, occupied) |
+            _positiveRay(RAY_DOWN_RIGHT, square, occupied) | _positiveRay(RAY_DOWN_LEFT, square, occupied))
+
+
+def _lineTables():
+    """
+    BETWEEN[a][b] - squares strictly between two aligned squares.
+    LINE[a][b] - the whole board-wide line through two aligned squares.
+    Both are 0 for squares that are not on a common rank, file or diagonal.
+    """
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    rays = (RAY_UP, RAY_LEFT, RAY_DOWN, RAY_RIGHT, RAY_UP_LEFT, RAY_UP_RIGHT, RAY_DOWN_RIGHT, RAY_DOWN_LEFT)
+    for direction in range(8):
+        ray = rays[direction]
+        opposite = rays[direction ^ 2]  # up <-> down, left <-> right, up/left <-> down/right, up/right <-> down/left
+        for start in range(64):
+            path = 0
+            targets = ray[start]
+            while targets:
+                end_bit = targets & -targets if direction in (2, 3, 6, 7) else 1 << (targets.bit_length() - 1)
+                targets ^= end_bit
+                end = end_bit.bit_length() - 1
+                between[start][end] = path
+                line[start][end] = ray[start] | opposite[start] | BITS[start]
+                path |= end_bit
+    return between, line
+
+
+BETWEEN, LINE = _lineTables()
+
+
+def squaresOf(bitboard):
+    """
+    Yield the square index of every set bit.
+    """
+    while bitboard:
+        bit = bitboard & -bitboard
+        bitboard ^= bit
+        yield bit.bit_length() - 1
+
+
+class BitboardGameState(ChessEngine.GameState):
+    """
+    GameState that keeps bitboards next to the 8x8 board and generates moves from them.
+    The board list is still kept up to date, so Move objects, the UI and the AI work unchanged.
+    """
+
+    def __init__(sky):
+        super().__init__()
+        sky.bitboards = {}
+        sky.occupied = {}
+        sky.loadBitboards()
+
+    def loadFEN(sky, fen):
+        super().loadFEN(fen)
+        sky.loadBitboards()
+
+    def loadBitboards(sky):
+        """
+        Rebuild all bitboards from sky.board.
+        """
+        sky.bitboards = {piece: 0 for piece in PIECES}
+        sky.occupied = {"w": 0, "b": 0}
+        for square in range(64):
+            row, col = SQUARES[square]
+            piece = sky.board[row][col]
+            if piece != "--":
+                sky.bitboards[piece] |= BITS[square]
+                sky.occupied[piece[0]] |= BITS[square]
+
+    def makeMove(sky, move):
+        super().makeMove(move)
+        sky.toggleMove(move)
+
+    def undoMove(sky):
+        if len(sky.move_log) != 0:
+            move = sky.move_log[-1]
+            super().undoMove()
+            sky.toggleMove(move)
+
+    def toggleMove(sky, move):
+        """
+        Flip the bits a move changes. XOR is its own inverse, so the same call makes and unmakes the move.
+        """
+        bitboards = sky.bitboards
+        occupied = sky.occupied
+        code = move.code
+        piece_moved = move.piece_moved
+        piece_captured = move.piece_captured
+        color = piece_moved[0]
+        start = code & 63
+        end = (code >> 6) & 63
+        start_bit = BITS[start]
+        end_bit = BITS[end]
+        bitboards[piece_moved] ^= start_bit
+        bitboards[color + "Q" if code & ChessEngine.Move.PROMOTION_FLAG else piece_moved] ^= end_bit
+        occupied[color] ^= start_bit | end_bit
+        if piece_captured != "--":
+            if code & ChessEngine.Move.ENPASSANT_FLAG:
+                captured_bit = BITS[(start & 56) | (end & 7)]  # beside the start square, on the end column
+            else:
+                captured_bit = end_bit
+            bitboards[piece_captured] ^= captured_bit
+            occupied[piece_captured[0]] ^= captured_bit
+        if code & ChessEngine.Move.CASTLE_FLAG:
+            if end - start == 2:  # king-side
+                rook_bits = BITS[end + 1] | BITS[end - 1]
+            else:  # queen-side
+                rook_bits = BITS[end - 2] | BITS[end + 1]
+            bitboards[color + "R"] ^= rook_bits
+            occupied[color] ^= rook_bits
+
+    def attackersTo(sky, square, color, occupied):
+        """
+        Bitboard of the pieces of the given color attacking square, with occupied as the blocking pieces.
+        """
+        bitboards = sky.bitboards
+        queens = bitboards[color + "Q"]
+        return ((KNIGHT_ATTACKS[square] & bitboards[color + "N"]) |
+                (KING_ATTACKS[square] & bitboards[color + "K"]) |
+                (PAWN_ATTACKS["b" if color == "w" else "w"][square] & bitboards[color + "p"]) |
+                (rookAttacks(square, occupied) & (bitboards[color + "R"] | queens)) |
+                (bishopAttacks(square, occupied) & (bitboards[color + "B"] | queens)))
+
+    def squareUnderAttack(sky, row, col):
+        """
+        Determine if enemy can attack the square row col
+        """
+        enemy_color = "b" if sky.white_to_move else "w"
+        return sky.attackersTo(row * 8 + col, enemy_color, sky.occupied["w"] | sky.occupied["b"]) != 0
+
+    def getValidMoves(sky):
+        """
+        All moves considering checks.
+        """
+        moves = sky.generateMoves()
+        if len(moves) == 0:
+            if sky.in_check:
+                sky.checkmate = True
+            else:
+                sky.stalemate = True
+            sky.draw_reason = None  # a mate or stalemate on the fiftieth move still counts
+        else:
+            sky.checkmate = False
+            sky.stalemate = False
+            sky.draw_reason = sky.drawReason()
+        return moves
+
+    def hasPieces(sky):
+        color = "w" if sky.white_to_move else "b"
+        bitboards = sky.bitboards
+        return sky.occupied[color] != bitboards[color + "K"] | bitboards[color + "p"]
+
+    def getCaptureMoves(sky):
+        """
+        Captures and promotions only, for the quiescence search.
+        In check it also returns the king's capturing evasions, callers should use getValidMoves then.
+        """
+        return sky.generateMoves(True, False)
+
+    def pinLines(sky, king_square, enemy_color, own, enemy):
+        """
+        Map every pinned allied piece to the line it is allowed to move along.
+        """
+        bitboards = sky.bitboards
+        queens = bitboards[enemy_color + "Q"]
+        snipers = ((rookAttacks(king_square, enemy) & (bitboards[enemy_color + "R"] | queens)) |
+                   (bishopAttacks(king_square, enemy) & (bitboards[enemy_color + "B"] | queens)))
+        pins = {}
+        for sniper in squaresOf(snipers):
+            blockers = BETWEEN[king_square][sniper] & own
+            if blockers and not blockers & (blockers - 1):  # exactly one allied piece in between
+                pins[blockers.bit_length() - 1] = LINE[king_square][sniper]
+        return pins
+
+    def generateMoves(sky, captures=True, quiet_moves=True, start_mask=FULL):
+        """
+        Legal moves for the side to move.
+        captures - captures, en-passant and promotions; quiet_moves - everything else, castling included.
+        Only pieces standing on start_mask are looked at.
+        """
+        board = sky.board
+        bitboards = sky.bitboards
+        if sky.white_to_move:
+            ally_color, enemy_color, forward, pawn_start_row, promotion_row = "w", "b", -8, 6, 0
+        else:
+            ally_color, enemy_color, forward, pawn_start_row, promotion_row = "b", "w", 8, 1, 7
+        own = sky.occupied[ally_color]
+        enemy = sky.occupied[enemy_color]
+        occupied = own | enemy
+        empty = ~occupied & FULL
+        king_square = bitboards[ally_color + "K"].bit_length() - 1
+        checkers = sky.attackersTo(king_square, enemy_color, occupied)
+        sky.in_check = checkers != 0
+        targets = (enemy if captures else 0) | (empty if quiet_moves else 0)
+        moves = []
+        Move = ChessEngine.Move
+
+        # king moves, the king itself must not block the attacks on its destination
+        if start_mask & BITS[king_square]:
+            occupied_without_king = occupied ^ BITS[king_square]
+            for end in squaresOf(KING_ATTACKS[king_square] & targets):
+                if not sky.attackersTo(end, enemy_color, occupied_without_king):
+                    moves.append(Move(SQUARES[king_square], SQUARES[end], board))
+            if quiet_moves and not checkers:
+                sky.getBitboardCastleMoves(king_square, enemy_color, occupied, moves)
+        if checkers & (checkers - 1):  # double check, king has to move
+            return moves
+        if checkers:  # single check, capture the checking piece or block the check
+            check_mask = checkers | BETWEEN[king_square][checkers.bit_length() - 1]
+        else:
+            check_mask = FULL
+        targets &= check_mask
+        pins = sky.pinLines(king_square, enemy_color, own, enemy)
+
+        # pawns
+        for start in squaresOf(bitboards[ally_color + "p"] & start_mask):
+            allowed = pins.get(start, FULL) & check_mask
+            one_step = start + forward
+            if BITS[one_step] & empty:
+                if (captures if one_step >> 3 == promotion_row else quiet_moves) and BITS[one_step] & allowed:
+                    moves.append(Move(SQUARES[start], SQUARES[one_step], board))
+                two_step = one_step + forward
+                if quiet_moves and start >> 3 == pawn_start_row and BITS[two_step] & empty & allowed:
+                    moves.append(Move(SQUARES[start], SQUARES[two_step], board))
+            if not captures:
+                continue
+            for end in squaresOf(PAWN_ATTACKS[ally_color][start] & enemy & allowed):
+                moves.append(Move(SQUARES[start], SQUARES[end], board))
+            if sky.enpassant_possible != ():
+                enpassant_square = sky.enpassant_possible[0] * 8 + sky.enpassant_possible[1]
+                if PAWN_ATTACKS[ally_color][start] & BITS[enpassant_square]:
+                    # both pawns leave the rank at once, so just test the resulting position directly
+                    captured_bit = BITS[enpassant_square - forward]
+                    occupied_after = (occupied ^ BITS[start] ^ captured_bit) | BITS[enpassant_square]
+                    if not sky.attackersTo(king_square, enemy_color, occupied_after) & ~captured_bit:
+                        moves.append(Move(SQUARES[start], SQUARES[enpassant_square], board, is_enpassant_move=True))
+
+        # knights, a pinned knight can never move
+        for start in squaresOf(bitboards[ally_color + "N"] & start_mask):
+            if start not in pins:
+                for end in squaresOf(KNIGHT_ATTACKS[start] & targets):
+                    moves.append(Move(SQUARES[start], SQUARES[end], board))
+
+        # sliding pieces
+        queens = bitboards[ally_color + "Q"]
+        for start in squaresOf((bitboards[ally_color + "B"] | queens) & start_mask):
+            for end in squaresOf(bishopAttacks(start, occupied) & targets & pins.get(start, FULL)):
+                moves.append(Move(SQUARES[start], SQUARES[end], board))
+        for start in squaresOf((bitboards[ally_color + "R"] | queens) & start_mask):
+            for end in squaresOf(rookAttacks(start, occupied) & targets & pins.get(start, FULL)):
+                moves.append(Move(SQUARES[start], SQUARES[end], board))
+        return moves
+
+    def getMoveByID(sky, move_id):
+        """
+        The legal move with the given moveID, or None. Only the piece on the start square is looked at.
+        """
+        start_row, start_col, end_row, end_col = ChessEngine.Move.decodeID(move_id)
+        for move in sky.generateMoves(True, True, BITS[start_row * 8 + start_col]):
+            if move.moveID == move_id:
+                return move
+        return None
+
+    def getStagedMoves(sky, hash_move_id=None, sort_stage=None):
+        """
+        Yield the legal moves in stages: the hash move, then captures and promotions, then quiet moves.
+        A stage is only generated when the previous one is used up, so a cutoff early on skips the rest.
+        sort_stage, if given, is called on the list of each stage before its moves are yielded.
+        """
+        if hash_move_id is not None:
+            hash_move = sky.getMoveByID(hash_move_id)
+            if hash_move is not None:
+                yield hash_move
+        for captures in (True, False):
+            moves = [move for move in sky.generateMoves(captures, not captures) if move.moveID != hash_move_id]
+            if sort_stage is not None:
+                sort_stage(moves)
+            yield from moves
+
+    def getBitboardCastleMoves(sky, king_square, enemy_color, occupied, moves):
+        rights = sky.current_castling_rights
+        if sky.white_to_move:
+            king_side, queen_side = rights.wks, rights.wqs
+        else:
+            king_side, queen_side = rights.bks, rights.bqs
+        if king_side and not occupied & (BITS[king_square + 1] | BITS[king_square + 2]):
+            if not sky.attackersTo(king_square + 1, enemy_color, occupied) and \
+                    not sky.attackersTo(king_square + 2, enemy_color, occupied):
+                moves.append(ChessEngine.Move(SQUARES[king_square], SQUARES[king_square + 2], sky.board,
+                                              is_castle_move=True))
+        if queen_side and not occupied & (BITS[king_square - 1] | BITS[king_square - 2] | BITS[king_square - 3]):
+            if not sky.attackersTo(king_square - 1, enemy_color, occupied) and \
+                    not sky.attackersTo(king_square - 2, enemy_color, occupied):
+                moves.append(ChessEngine.Move(SQUARES[king_square], SQUARES[king_square - 2], sky.board,
+                                              is_castle_move=True))
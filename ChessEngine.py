@@ -3,6 +3,101 @@ Storing all the information about the current state of chess game.
 Determining valid moves at current state.
 It will keep move log.
 """
+import random
+
+# Zobrist keys, one random 64-bit number per (piece, square), side to move, castling rights and en-passant file.
+# The generator is seeded, so a position has the same key in every process.
+zobrist_random = random.Random(20240518)
+ZOBRIST_PIECES = {color + piece: [[zobrist_random.getrandbits(64) for col in range(8)] for row in range(8)]
+                  for color in "wb" for piece in "pRNBQK"}
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for rights in range(16)]  # indexed by CastleRights.index()
+ZOBRIST_ENPASSANT = [zobrist_random.getrandbits(64) for col in range(8)]
+
+# piece values and piece-square tables, the GameState keeps running totals of both for the AI
+piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+
+knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
+                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
+                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
+                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
+                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
+                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
+                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
+                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
+
+bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
+                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
+                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
+                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
+                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
+
+rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
+
+queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
+                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
+
+pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
+               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
+               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
+               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
+               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
+               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
+               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
+               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
+
+piece_position_scores = {"wN": knight_scores,
+                         "bN": knight_scores[::-1],
+                         "wB": bishop_scores,
+                         "bB": bishop_scores[::-1],
+                         "wQ": queen_scores,
+                         "bQ": queen_scores[::-1],
+                         "wR": rook_scores,
+                         "bR": rook_scores[::-1],
+                         "wp": pawn_scores,
+                         "bp": pawn_scores[::-1]}
+king_scores = [[0.0] * 8 for row in range(8)]
+piece_square_scores = dict(piece_position_scores, wK=king_scores, bK=king_scores)  # every piece, kings score 0
+
+
+def parseEPD(line):
+    """
+    Split an EPD line such as 'r1b1k2r/... w KQkq - bm Nf3; id "test 1";' into a FEN string and
+    a dictionary of its operations ({"bm": "Nf3", "id": "test 1"}).
+    A plain FEN line is accepted too and comes back with no operations.
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD needs at least 4 fields: " + line)
+    rest = fields[4] if len(fields) == 5 else ""
+    counters = rest.split()
+    if len(counters) == 2 and counters[0].isdigit() and counters[1].isdigit():  # a full FEN
+        return " ".join(fields[:4] + counters), {}
+    operations = {}
+    for operation in rest.split(";"):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(" ")
+            operations[opcode] = operand.strip().strip('"')
+    halfmove_clock = operations.get("hmvc", "0")
+    fullmove_number = operations.get("fmvn", "1")
+    return " ".join(fields[:4] + [halfmove_clock, fullmove_number]), operations
 
 
 class GameState:
@@ -38,57 +133,272 @@ class GameState:
         sky.current_castling_rights = CastleRights(True, True, True, True)
         sky.castle_rights_log = [CastleRights(sky.current_castling_rights.wks, sky.current_castling_rights.bks,
                                                sky.current_castling_rights.wqs, sky.current_castling_rights.bqs)]
+        sky.zobrist_key = sky.computeZobristKey()
+        sky.zobrist_key_log = [sky.zobrist_key]
+        # running material and piece-square totals, makeMove adds the change of every move
+        sky.white_material, sky.black_material, sky.white_position_score, sky.black_position_score = \
+            sky.computeScores()
+        sky.score_log = [(sky.white_material, sky.black_material, sky.white_position_score, sky.black_position_score)]
+        # plies since the last capture or pawn move, for the fifty-move rule and for finding repetitions
+        sky.halfmove_clock = 0
+        sky.halfmove_clock_log = [sky.halfmove_clock]
+        sky.draw_reason = None  # set by getValidMoves when the game is drawn by the fifty-move rule or a repetition
+        # move number of the start position, for getFEN
+        sky.start_fullmove_number = 1
+
+    def loadFEN(sky, fen):
+        """
+        Set up the position of a FEN string, e.g. "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1".
+        The move log and all the other logs start again from this position.
+        Raises ValueError for a position the move generator can't play from. Castling rights whose king
+        or rook is off its home square are dropped.
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        placement, side, castling, enpassant = fields[:4]
+        board = []
+        for rank in placement.split("/"):
+            row = []
+            for symbol in rank:
+                if symbol.isdigit():
+                    row += ["--"] * int(symbol)
+                elif symbol.upper() in "PRNBQK":
+                    piece = "p" if symbol in "Pp" else symbol.upper()
+                    row.append(("w" if symbol.isupper() else "b") + piece)
+                else:
+                    raise ValueError("unknown piece '" + symbol + "' in FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("every rank needs 8 squares in FEN: " + fen)
+            board.append(row)
+        if len(board) != 8 or side not in ("w", "b"):
+            raise ValueError("invalid FEN: " + fen)
+        counters = fields[4:6]
+        if not all(counter.isdigit() for counter in counters):
+            raise ValueError("move counters must be numbers in FEN: " + fen)
+        pieces = [piece for row in board for piece in row]
+        if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError("FEN needs exactly one king of each color: " + fen)
+        if castling != "-" and (not castling or any(symbol not in "KQkq" for symbol in castling)):
+            raise ValueError("invalid castling rights in FEN: " + fen)
+        if enpassant != "-":
+            # the square a pawn of the side not to move just passed over, with that pawn in front of it
+            if len(enpassant) != 2 or enpassant[0] not in Move.files_to_cols or \
+                    enpassant[1] != ("6" if side == "w" else "3"):
+                raise ValueError("invalid en passant square in FEN: " + fen)
+            pawn_row = Move.ranks_to_rows[enpassant[1]] + (1 if side == "w" else -1)
+            if board[pawn_row][Move.files_to_cols[enpassant[0]]] != ("b" if side == "w" else "w") + "p":
+                raise ValueError("no pawn has just passed the en passant square in FEN: " + fen)
+        # the side to move could capture a king left in check
+        previous_board, sky.board = sky.board, board  # squareAttackedBy looks at sky.board
+        king_row, king_col = divmod(pieces.index("bK" if side == "w" else "wK"), 8)
+        if sky.squareAttackedBy(king_row, king_col, side):
+            sky.board = previous_board
+            raise ValueError("the side not to move is in check in FEN: " + fen)
+        sky.board = board
+        sky.white_to_move = side == "w"
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    sky.white_king_location = (row, col)
+                elif board[row][col] == "bK":
+                    sky.black_king_location = (row, col)
+        sky.move_log = []
+        sky.checkmate = False
+        sky.stalemate = False
+        sky.in_check = False
+        sky.pins = []
+        sky.checks = []
+        if enpassant == "-":
+            sky.enpassant_possible = ()
+        else:
+            sky.enpassant_possible = (Move.ranks_to_rows[enpassant[1]], Move.files_to_cols[enpassant[0]])
+        sky.enpassant_possible_log = [sky.enpassant_possible]
+        white_home = board[7][4] == "wK"
+        black_home = board[0][4] == "bK"
+        sky.current_castling_rights = CastleRights("K" in castling and white_home and board[7][7] == "wR",
+                                                   "k" in castling and black_home and board[0][7] == "bR",
+                                                   "Q" in castling and white_home and board[7][0] == "wR",
+                                                   "q" in castling and black_home and board[0][0] == "bR")
+        sky.castle_rights_log = [CastleRights(sky.current_castling_rights.wks, sky.current_castling_rights.bks,
+                                               sky.current_castling_rights.wqs, sky.current_castling_rights.bqs)]
+        sky.zobrist_key = sky.computeZobristKey()
+        sky.zobrist_key_log = [sky.zobrist_key]
+        sky.white_material, sky.black_material, sky.white_position_score, sky.black_position_score = \
+            sky.computeScores()
+        sky.score_log = [(sky.white_material, sky.black_material, sky.white_position_score, sky.black_position_score)]
+        sky.halfmove_clock = int(counters[0]) if len(counters) > 0 else 0
+        sky.halfmove_clock_log = [sky.halfmove_clock]
+        sky.draw_reason = None
+        sky.start_fullmove_number = int(counters[1]) if len(counters) > 1 else 1
+
+    def getFEN(sky):
+        """
+        FEN string of the current position, the move counters are counted on from the ones the game started with.
+        """
+        ranks = []
+        for row in sky.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                symbol = "P" if piece[1] == "p" else piece[1]
+                rank += symbol if piece[0] == "w" else symbol.lower()
+            ranks.append(rank + str(empty) if empty else rank)
+        rights = sky.current_castling_rights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + \
+                   ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if sky.enpassant_possible != ():
+            enpassant = Move.cols_to_files[sky.enpassant_possible[1]] + Move.rows_to_ranks[sky.enpassant_possible[0]]
+        else:
+            enpassant = "-"
+        plies = len(sky.move_log)
+        if sky.white_to_move == (plies % 2 == 1):  # black moved first
+            plies += 1
+        fullmove_number = sky.start_fullmove_number + plies // 2
+        return " ".join(("/".join(ranks), "w" if sky.white_to_move else "b", castling or "-", enpassant,
+                         str(sky.halfmove_clock), str(fullmove_number)))
+
+    def computeScores(sky):
+        """
+        Material and piece-square totals of both sides computed from scratch:
+        (white material, black material, white position score, black position score).
+        """
+        scores = {"w": [0, 0], "b": [0, 0]}
+        for row in range(8):
+            for col in range(8):
+                piece = sky.board[row][col]
+                if piece != "--":
+                    scores[piece[0]][0] += piece_score[piece[1]]
+                    scores[piece[0]][1] += piece_square_scores[piece][row][col]
+        return scores["w"][0], scores["b"][0], scores["w"][1], scores["b"][1]
+
+    def computeZobristKey(sky):
+        """
+        Compute the Zobrist key of the current position from scratch.
+        makeMove and undoMove keep sky.zobrist_key up to date, this is for setting up and checking positions.
+        """
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = sky.board[row][col]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][row][col]
+        if not sky.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[sky.current_castling_rights.index()]
+        if sky.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[sky.enpassant_possible[1]]
+        return key
 
     def makeMove(sky, move):
         """
         Takes a Move as a parameter and executes it.
         (this will not work for castling, pawn promotion and en-passant)
         """
-        sky.board[move.start_row][move.start_col] = "--"
-        sky.board[move.end_row][move.end_col] = move.piece_moved
+        # decode the move once, the Move properties would decode it again on every use
+        code = move.code
+        piece_moved = move.piece_moved
+        piece_captured = move.piece_captured
+        start_row, start_col, end_row, end_col = (code >> 3) & 7, code & 7, (code >> 9) & 7, (code >> 6) & 7
+        mover_position_change = -piece_square_scores[piece_moved][start_row][start_col]
+        mover_material_change = 0
+        key = sky.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[piece_moved][start_row][start_col]
+        if sky.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[sky.enpassant_possible[1]]
+        sky.board[start_row][start_col] = "--"
+        sky.board[end_row][end_col] = piece_moved
         sky.move_log.append(move)  # log the move so we can undo it later
         sky.white_to_move = not sky.white_to_move  # switch players
         # update king's location if moved
-        if move.piece_moved == "wK":
-            sky.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
-            sky.black_king_location = (move.end_row, move.end_col)
+        if piece_moved == "wK":
+            sky.white_king_location = (end_row, end_col)
+        elif piece_moved == "bK":
+            sky.black_king_location = (end_row, end_col)
 
         # pawn promotion
-        if move.is_pawn_promotion:
+        if code & Move.PROMOTION_FLAG:
             # if not is_AI:
             #    promoted_piece = input("Promote to Q, R, B, or N:") #take this to UI later
-            #    sky.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted_piece
+            #    sky.board[end_row][end_col] = move.piece_moved[0] + promoted_piece
             # else:
-            sky.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+            sky.board[end_row][end_col] = piece_moved[0] + "Q"
+            mover_material_change = piece_score["Q"] - piece_score["p"]
+        placed_piece = sky.board[end_row][end_col]
+        key ^= ZOBRIST_PIECES[placed_piece][end_row][end_col]
+        mover_position_change += piece_square_scores[placed_piece][end_row][end_col]
 
         # enpassant move
-        if move.is_enpassant_move:
-            sky.board[move.start_row][move.end_col] = "--"  # capturing the pawn
+        captured_material = captured_position_score = 0
+        if code & Move.ENPASSANT_FLAG:
+            sky.board[start_row][end_col] = "--"  # capturing the pawn
+            key ^= ZOBRIST_PIECES[piece_captured][start_row][end_col]
+            captured_material = piece_score["p"]
+            captured_position_score = piece_square_scores[piece_captured][start_row][end_col]
+        elif piece_captured != "--":
+            key ^= ZOBRIST_PIECES[piece_captured][end_row][end_col]
+            captured_material = piece_score[piece_captured[1]]
+            captured_position_score = piece_square_scores[piece_captured][end_row][end_col]
 
         # update enpassant_possible variable
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:  # only on 2 square pawn advance
-            sky.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+        if piece_moved[1] == "p" and abs(start_row - end_row) == 2:  # only on 2 square pawn advance
+            sky.enpassant_possible = ((start_row + end_row) // 2, start_col)
+            key ^= ZOBRIST_ENPASSANT[start_col]
         else:
             sky.enpassant_possible = ()
 
         # castle move
-        if move.is_castle_move:
-            if move.end_col - move.start_col == 2:  # king-side castle move
-                sky.board[move.end_row][move.end_col - 1] = sky.board[move.end_row][
-                    move.end_col + 1]  # moves the rook to its new square
-                sky.board[move.end_row][move.end_col + 1] = '--'  # erase old rook
+        if code & Move.CASTLE_FLAG:
+            rook_keys = ZOBRIST_PIECES[piece_moved[0] + "R"][end_row]
+            rook_square_scores = piece_square_scores[piece_moved[0] + "R"][end_row]
+            if end_col - start_col == 2:  # king-side castle move
+                sky.board[end_row][end_col - 1] = sky.board[end_row][
+                    end_col + 1]  # moves the rook to its new square
+                sky.board[end_row][end_col + 1] = '--'  # erase old rook
+                key ^= rook_keys[end_col + 1] ^ rook_keys[end_col - 1]
+                mover_position_change += rook_square_scores[end_col - 1] - rook_square_scores[end_col + 1]
             else:  # queen-side castle move
-                sky.board[move.end_row][move.end_col + 1] = sky.board[move.end_row][
-                    move.end_col - 2]  # moves the rook to its new square
-                sky.board[move.end_row][move.end_col - 2] = '--'  # erase old rook
+                sky.board[end_row][end_col + 1] = sky.board[end_row][
+                    end_col - 2]  # moves the rook to its new square
+                sky.board[end_row][end_col - 2] = '--'  # erase old rook
+                key ^= rook_keys[end_col - 2] ^ rook_keys[end_col + 1]
+                mover_position_change += rook_square_scores[end_col + 1] - rook_square_scores[end_col - 2]
 
         sky.enpassant_possible_log.append(sky.enpassant_possible)
 
         # update castling rights - whenever it is a rook or king move
+        key ^= ZOBRIST_CASTLING[sky.current_castling_rights.index()]
         sky.updateCastleRights(move)
+        key ^= ZOBRIST_CASTLING[sky.current_castling_rights.index()]
         sky.castle_rights_log.append(CastleRights(sky.current_castling_rights.wks, sky.current_castling_rights.bks,
                                                    sky.current_castling_rights.wqs, sky.current_castling_rights.bqs))
+        sky.zobrist_key = key
+        sky.zobrist_key_log.append(key)
+        if piece_moved[1] == "p" or piece_captured != "--":  # nothing before this can come back
+            sky.halfmove_clock = 0
+        else:
+            sky.halfmove_clock += 1
+        sky.halfmove_clock_log.append(sky.halfmove_clock)
+
+        # update the running scores, the mover is the side that was to move before the switch above
+        if sky.white_to_move:
+            sky.black_material += mover_material_change
+            sky.black_position_score += mover_position_change
+            sky.white_material -= captured_material
+            sky.white_position_score -= captured_position_score
+        else:
+            sky.white_material += mover_material_change
+            sky.white_position_score += mover_position_change
+            sky.black_material -= captured_material
+            sky.black_position_score -= captured_position_score
+        sky.score_log.append((sky.white_material, sky.black_material, sky.white_position_score,
+                              sky.black_position_score))
 
     def undoMove(sky):
         """
@@ -96,50 +406,129 @@ class GameState:
         """
         if len(sky.move_log) != 0:  # make sure that there is a move to undo
             move = sky.move_log.pop()
-            sky.board[move.start_row][move.start_col] = move.piece_moved
-            sky.board[move.end_row][move.end_col] = move.piece_captured
+            code = move.code
+            piece_moved = move.piece_moved
+            start_row, start_col, end_row, end_col = (code >> 3) & 7, code & 7, (code >> 9) & 7, (code >> 6) & 7
+            sky.board[start_row][start_col] = piece_moved
+            sky.board[end_row][end_col] = move.piece_captured
             sky.white_to_move = not sky.white_to_move  # swap players
             # update the king's position if needed
-            if move.piece_moved == "wK":
-                sky.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                sky.black_king_location = (move.start_row, move.start_col)
+            if piece_moved == "wK":
+                sky.white_king_location = (start_row, start_col)
+            elif piece_moved == "bK":
+                sky.black_king_location = (start_row, start_col)
             # undo en passant move
-            if move.is_enpassant_move:
-                sky.board[move.end_row][move.end_col] = "--"  # leave landing square blank
-                sky.board[move.start_row][move.end_col] = move.piece_captured
+            if code & Move.ENPASSANT_FLAG:
+                sky.board[end_row][end_col] = "--"  # leave landing square blank
+                sky.board[start_row][end_col] = move.piece_captured
 
             sky.enpassant_possible_log.pop()
             sky.enpassant_possible = sky.enpassant_possible_log[-1]
 
             # undo castle rights
             sky.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            sky.current_castling_rights = sky.castle_rights_log[
-                -1]  # set the current castle rights to the last one in the list
+            last_rights = sky.castle_rights_log[-1]  # set the current castle rights to a copy of the last one
+            sky.current_castling_rights = CastleRights(last_rights.wks, last_rights.bks,
+                                                       last_rights.wqs, last_rights.bqs)
             # undo the castle move
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2:  # king-side
-                    sky.board[move.end_row][move.end_col + 1] = sky.board[move.end_row][move.end_col - 1]
-                    sky.board[move.end_row][move.end_col - 1] = '--'
+            if code & Move.CASTLE_FLAG:
+                if end_col - start_col == 2:  # king-side
+                    sky.board[end_row][end_col + 1] = sky.board[end_row][end_col - 1]
+                    sky.board[end_row][end_col - 1] = '--'
                 else:  # queen-side
-                    sky.board[move.end_row][move.end_col - 2] = sky.board[move.end_row][move.end_col + 1]
-                    sky.board[move.end_row][move.end_col + 1] = '--'
+                    sky.board[end_row][end_col - 2] = sky.board[end_row][end_col + 1]
+                    sky.board[end_row][end_col + 1] = '--'
+            sky.zobrist_key_log.pop()
+            sky.zobrist_key = sky.zobrist_key_log[-1]
+            sky.halfmove_clock_log.pop()
+            sky.halfmove_clock = sky.halfmove_clock_log[-1]
+            sky.score_log.pop()
+            sky.white_material, sky.black_material, sky.white_position_score, sky.black_position_score = \
+                sky.score_log[-1]
             sky.checkmate = False
             sky.stalemate = False
+            sky.draw_reason = None
+
+    def makeNullMove(sky):
+        """
+        Pass the turn to the opponent without moving, for null-move pruning in the search, undone by undoNullMove.
+        It isn't put in the move log, and it resets the halfmove clock so no repetition is looked for across it.
+        """
+        key = sky.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        if sky.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[sky.enpassant_possible[1]]
+        sky.white_to_move = not sky.white_to_move
+        sky.enpassant_possible = ()
+        sky.enpassant_possible_log.append(sky.enpassant_possible)
+        sky.zobrist_key = key
+        sky.zobrist_key_log.append(key)
+        sky.halfmove_clock = 0
+        sky.halfmove_clock_log.append(sky.halfmove_clock)
+
+    def undoNullMove(sky):
+        """
+        Take back the pass of makeNullMove: the turn, en-passant square, key and halfmove clock from before it.
+        """
+        sky.white_to_move = not sky.white_to_move
+        sky.enpassant_possible_log.pop()
+        sky.enpassant_possible = sky.enpassant_possible_log[-1]
+        sky.zobrist_key_log.pop()
+        sky.zobrist_key = sky.zobrist_key_log[-1]
+        sky.halfmove_clock_log.pop()
+        sky.halfmove_clock = sky.halfmove_clock_log[-1]
+
+    def hasPieces(sky):
+        """
+        True if the side to move has a piece other than its king and pawns.
+        Without one it is often in zugzwang, where passing would be better than any move.
+        """
+        color = "w" if sky.white_to_move else "b"
+        return any(piece[0] == color and piece[1] not in "Kp" for row in sky.board for piece in row)
+
+    def isRepetition(sky, times=1):
+        """
+        True if the current position occurred at least times times before, times=2 is a threefold repetition.
+        Only the positions since the last capture or pawn move are looked at, none before it can come back,
+        and only every second one of them, the ones with the same side to move.
+        """
+        keys = sky.zobrist_key_log
+        if sky.halfmove_clock < 4:  # it takes at least 4 plies to get back to a position
+            return False
+        key = sky.zobrist_key
+        earliest = max(0, len(keys) - 1 - sky.halfmove_clock)
+        seen = 0
+        for index in range(len(keys) - 5, earliest - 1, -2):
+            if keys[index] == key:
+                seen += 1
+                if seen >= times:
+                    return True
+        return False
+
+    def drawReason(sky):
+        """
+        "fifty-move rule" or "threefold repetition" if the game is drawn by one of them, otherwise None.
+        """
+        if sky.halfmove_clock >= 100:
+            return "fifty-move rule"
+        if sky.isRepetition(2):
+            return "threefold repetition"
+        return None
 
     def updateCastleRights(sky, move):
         """
         Update the castle rights given the move
         """
+        code = move.code
+        start_row, start_col, end_col = (code >> 3) & 7, code & 7, (code >> 6) & 7
         if move.piece_captured == "wR":
-            if move.end_col == 0:  # left rook
+            if end_col == 0:  # left rook
                 sky.current_castling_rights.wqs = False
-            elif move.end_col == 7:  # right rook
+            elif end_col == 7:  # right rook
                 sky.current_castling_rights.wks = False
         elif move.piece_captured == "bR":
-            if move.end_col == 0:  # left rook
+            if end_col == 0:  # left rook
                 sky.current_castling_rights.bqs = False
-            elif move.end_col == 7:  # right rook
+            elif end_col == 7:  # right rook
                 sky.current_castling_rights.bks = False
 
         if move.piece_moved == 'wK':
@@ -149,16 +538,16 @@ class GameState:
             sky.current_castling_rights.bqs = False
             sky.current_castling_rights.bks = False
         elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
+            if start_row == 7:
+                if start_col == 0:  # left rook
                     sky.current_castling_rights.wqs = False
-                elif move.start_col == 7:  # right rook
+                elif start_col == 7:  # right rook
                     sky.current_castling_rights.wks = False
         elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
+            if start_row == 0:
+                if start_col == 0:  # left rook
                     sky.current_castling_rights.bqs = False
-                elif move.start_col == 7:  # right rook
+                elif start_col == 7:  # right rook
                     sky.current_castling_rights.bks = False
 
     def getValidMoves(sky):
@@ -179,30 +568,13 @@ class GameState:
             king_col = sky.black_king_location[1]
         if sky.in_check:
             if len(sky.checks) == 1:  # only 1 check, block the check or move the king
-                moves = sky.getAllPossibleMoves()
                 # to block the check you must put a piece into one of the squares between the enemy piece and your king
-                check = sky.checks[0]  # check information
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = sky.board[check_row][check_col]
-                valid_squares = []  # squares that pieces can move to
-                # if knight, must capture the knight or move your king, other pieces can be blocked
-                if piece_checking[1] == "N":
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i,
-                                        king_col + check[3] * i)  # check[2] and check[3] are the check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[
-                            1] == check_col:  # once you get to piece and check
-                            break
+                valid_squares = sky.getCheckBlockSquares(king_row, king_col)
                 # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # iterate through the list backwards when removing elements
-                    if moves[i].piece_moved[1] != "K":  # move doesn't move king so it must block or capture
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:  # move doesn't block or capture piece
-                            moves.remove(moves[i])
+                # an en passant capture answers the check of the pawn it takes, which it doesn't land on
+                moves = [move for move in sky.getAllPossibleMoves()
+                         if move.piece_moved[1] == "K" or (move.end_row, move.end_col) in valid_squares or
+                         (move.is_enpassant_move and (move.start_row, move.end_col) in valid_squares)]
             else:  # double check, king has to move
                 sky.getKingMoves(king_row, king_col, moves)
         else:  # not in check - all moves are fine
@@ -216,15 +588,125 @@ class GameState:
             if sky.inCheck():
                 sky.checkmate = True
             else:
-                # TODO stalemate on repeated moves
                 sky.stalemate = True
+            sky.draw_reason = None  # a mate or stalemate on the fiftieth move still counts
         else:
             sky.checkmate = False
             sky.stalemate = False
+            sky.draw_reason = sky.drawReason()
 
         sky.current_castling_rights = temp_castle_rights
         return moves
 
+    def getCheckBlockSquares(sky, king_row, king_col):
+        """
+        Set of squares a piece other than the king can move to in order to answer the single check in sky.checks.
+        """
+        check = sky.checks[0]  # check information
+        check_row = check[0]
+        check_col = check[1]
+        # if knight, must capture the knight or move your king, other pieces can be blocked
+        if sky.board[check_row][check_col][1] == "N":
+            return {(check_row, check_col)}
+        valid_squares = set()
+        for i in range(1, 8):
+            # check[2] and check[3] are the check directions
+            valid_square = (king_row + check[2] * i, king_col + check[3] * i)
+            valid_squares.add(valid_square)
+            if valid_square == (check_row, check_col):  # once you get to piece and check
+                break
+        return valid_squares
+
+    def getMoveByID(sky, move_id):
+        """
+        The legal move with the given moveID, or None. Only the moves of the piece on the start square are generated.
+        """
+        start_row, start_col, end_row, end_col = Move.decodeID(move_id)
+        piece = sky.board[start_row][start_col]
+        if piece[0] != ("w" if sky.white_to_move else "b"):
+            return None
+        sky.in_check, sky.pins, sky.checks = sky.checkForPinsAndChecks()
+        moves = []
+        if piece[1] == "K":
+            sky.getKingMoves(start_row, start_col, moves)
+            if not sky.in_check:
+                sky.getCastleMoves(start_row, start_col, moves)
+        elif len(sky.checks) < 2:  # in double check only the king can move
+            sky.moveFunctions[piece[1]](start_row, start_col, moves)
+            if sky.in_check:
+                king_row, king_col = sky.white_king_location if sky.white_to_move else sky.black_king_location
+                valid_squares = sky.getCheckBlockSquares(king_row, king_col)
+                moves = [move for move in moves if (move.end_row, move.end_col) in valid_squares]
+        for move in moves:
+            if move.moveID == move_id:
+                return move
+        return None
+
+    def getMoveBySAN(sky, san):
+        """
+        The legal move written in standard algebraic notation (e.g. "Nf3", "exd5", "O-O", "e8=Q+"), or None.
+        """
+        san = san.rstrip("+#!?")
+        moves = sky.getValidMoves()
+        if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            end_col = 6 if len(san) == 3 else 2
+            for move in moves:
+                if move.is_castle_move and move.end_col == end_col:
+                    return move
+            return None
+        if "=" in san:
+            san, promotion = san.split("=", 1)
+            if promotion != "Q":  # pawns only ever promote to a queen
+                return None
+        piece = san[0] if san[0] in "RNBQK" else "p"
+        san = san.lstrip("RNBQK").replace("x", "")
+        if len(san) < 2 or san[-2] not in Move.files_to_cols or san[-1] not in Move.ranks_to_rows:
+            return None
+        end_row, end_col = Move.ranks_to_rows[san[-1]], Move.files_to_cols[san[-2]]
+        matches = []
+        for move in moves:
+            if move.piece_moved[1] == piece and move.end_row == end_row and move.end_col == end_col:
+                # the characters before the end square tell moves of the same piece type apart
+                if all(move.start_col == Move.files_to_cols[hint] if hint in Move.files_to_cols else
+                       move.start_row == Move.ranks_to_rows.get(hint) for hint in san[:-2]):
+                    matches.append(move)
+        return matches[0] if len(matches) == 1 else None
+
+    def getStagedMoves(sky, hash_move_id=None, sort_stage=None):
+        """
+        The legal moves in the order of the stages of BitboardGameState.getStagedMoves: the hash move,
+        then captures and promotions, then quiet moves. Staged generation is bitboard-only, the 8x8 board
+        generates all its moves at once and just yields them in that order.
+        sort_stage, if given, is called on the list of each stage before its moves are yielded.
+        """
+        hash_moves = []
+        captures = []
+        quiet_moves = []
+        for move in sky.getValidMoves():
+            if move.moveID == hash_move_id:
+                hash_moves.append(move)
+            elif move.is_capture or move.is_pawn_promotion:
+                captures.append(move)
+            else:
+                quiet_moves.append(move)
+        yield from hash_moves
+        for stage in (captures, quiet_moves):
+            if sort_stage is not None:
+                sort_stage(stage)
+            yield from stage
+
+    def getCaptureMoves(sky):
+        """
+        Captures and promotions only, for the quiescence search.
+        When in check all evasions are needed instead, so callers should look at sky.in_check
+        and fall back to getValidMoves.
+        """
+        sky.in_check, sky.pins, sky.checks = sky.checkForPinsAndChecks()
+        if sky.in_check:
+            return []
+        moves = sky.getAllPossibleMoves()  # without checks castling is skipped, it can never capture
+        return [move for move in moves if move.is_capture or move.is_pawn_promotion]
+
     def inCheck(sky):
         """
         Determine if a current player is in check
@@ -238,13 +720,54 @@ class GameState:
         """
         Determine if enemy can attack the square row col
         """
-        sky.white_to_move = not sky.white_to_move  # switch to opponent's point of view
-        opponents_moves = sky.getAllPossibleMoves()
-        sky.white_to_move = not sky.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # square is under attack
-                return True
-        return False
+        return sky.squareAttackedBy(row, col, "b" if sky.white_to_move else "w")
+
+    def squareAttackedBy(sky, row, col, color, find_attackers=False):
+        """
+        Determine if a piece of the given color attacks the square row col.
+        Looks outward from the square along the rays, knight jumps and pawn diagonals instead of generating moves.
+        With find_attackers it returns the list of (row, col) of all attacking pieces instead of True/False.
+        """
+        board = sky.board
+        attackers = [] if find_attackers else None
+        # a pawn attacks diagonally forward, so it stands one row behind the square from its own point of view
+        pawn_row = row + 1 if color == "w" else row - 1
+        if 0 <= pawn_row <= 7:
+            for pawn_col in (col - 1, col + 1):
+                if 0 <= pawn_col <= 7:
+                    piece = board[pawn_row][pawn_col]
+                    if piece[0] == color and piece[1] == "p":
+                        if not find_attackers:
+                            return True
+                        attackers.append((pawn_row, pawn_col))
+        for d_row, d_col in ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2)):
+            end_row = row + d_row
+            end_col = col + d_col
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                piece = board[end_row][end_col]
+                if piece[0] == color and piece[1] == "N":
+                    if not find_attackers:
+                        return True
+                    attackers.append((end_row, end_col))
+        # first 4 directions are orthogonal (rook, queen), the last 4 diagonal (bishop, queen)
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for j in range(8):
+            d_row, d_col = directions[j]
+            for i in range(1, 8):
+                end_row = row + d_row * i
+                end_col = col + d_col * i
+                if not (0 <= end_row <= 7 and 0 <= end_col <= 7):
+                    break  # off board
+                piece = board[end_row][end_col]
+                if piece == "--":
+                    continue
+                if piece[0] == color and (piece[1] == "Q" or (i == 1 and piece[1] == "K") or (
+                        j <= 3 and piece[1] == "R") or (j >= 4 and piece[1] == "B")):
+                    if not find_attackers:
+                        return True
+                    attackers.append((end_row, end_col))
+                break  # the first piece blocks the rest of the ray
+        return attackers if find_attackers else False
 
     def getAllPossibleMoves(sky):
         """
@@ -328,7 +851,7 @@ class GameState:
         Get all the pawn moves for the pawn located at row, col and add the moves to the list.
         """
         piece_pinned = False
-        pin_direction = ()
+        pin_direction = ()  # points away from the king, a pinned pawn may move either way along it
         for i in range(len(sky.pins) - 1, -1, -1):
             if sky.pins[i][0] == row and sky.pins[i][1] == col:
                 piece_pinned = True
@@ -348,95 +871,75 @@ class GameState:
             king_row, king_col = sky.black_king_location
 
         if sky.board[row + move_amount][col] == "--":  # 1 square pawn advance
-            if not piece_pinned or pin_direction == (move_amount, 0):
+            if not piece_pinned or pin_direction in ((move_amount, 0), (-move_amount, 0)):
                 moves.append(Move((row, col), (row + move_amount, col), sky.board))
                 if row == start_row and sky.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
                     moves.append(Move((row, col), (row + 2 * move_amount, col), sky.board))
         if col - 1 >= 0:  # capture to the left
-            if not piece_pinned or pin_direction == (move_amount, -1):
+            if not piece_pinned or pin_direction in ((move_amount, -1), (-move_amount, 1)):
                 if sky.board[row + move_amount][col - 1][0] == enemy_color:
                     moves.append(Move((row, col), (row + move_amount, col - 1), sky.board))
-                if (row + move_amount, col - 1) == sky.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col - 1)
-                            outside_range = range(col + 1, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col, -1)
-                            outside_range = range(col - 2, -1, -1)
-                        for i in inside_range:
-                            if sky.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = sky.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col - 1), sky.board, is_enpassant_move=True))
+                if (row + move_amount, col - 1) == sky.enpassant_possible and \
+                        not sky.enpassantExposesKing(row, col, col - 1, king_row, king_col, enemy_color):
+                    moves.append(Move((row, col), (row + move_amount, col - 1), sky.board, is_enpassant_move=True))
         if col + 1 <= 7:  # capture to the right
-            if not piece_pinned or pin_direction == (move_amount, +1):
+            if not piece_pinned or pin_direction in ((move_amount, 1), (-move_amount, -1)):
                 if sky.board[row + move_amount][col + 1][0] == enemy_color:
                     moves.append(Move((row, col), (row + move_amount, col + 1), sky.board))
-                if (row + move_amount, col + 1) == sky.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col)
-                            outside_range = range(col + 2, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col + 1, -1)
-                            outside_range = range(col - 1, -1, -1)
-                        for i in inside_range:
-                            if sky.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = sky.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col + 1), sky.board, is_enpassant_move=True))
+                if (row + move_amount, col + 1) == sky.enpassant_possible and \
+                        not sky.enpassantExposesKing(row, col, col + 1, king_row, king_col, enemy_color):
+                    moves.append(Move((row, col), (row + move_amount, col + 1), sky.board, is_enpassant_move=True))
+
+    def enpassantExposesKing(sky, row, col, captured_col, king_row, king_col, enemy_color):
+        """
+        True if the pawn at row, col capturing en passant on captured_col opens the king's rank to a rook or queen.
+        Both pawns leave the rank at once, so no pin found beforehand covers it.
+        """
+        if king_row != row:
+            return False
+        step = 1 if col > king_col else -1
+        for i in range(king_col + step, 8 if step == 1 else -1, step):
+            if i == col or i == captured_col:
+                continue
+            square = sky.board[row][i]
+            if square != "--":  # the first piece beyond the king decides
+                return square[0] == enemy_color and square[1] in "RQ"
+        return False
 
     def getRookMoves(sky, row, col, moves):
         """
         Get all the rook moves for the rook located at row, col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(sky.pins) - 1, -1, -1):
-            if sky.pins[i][0] == row and sky.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (sky.pins[i][2], sky.pins[i][3])
-                if sky.board[row][col][
-                    1] != "Q":  # can't remove queen from pin on rook moves, only remove it on bishop moves
-                    sky.pins.remove(sky.pins[i])
+        sky.getSlidingMoves(row, col, moves, ((-1, 0), (0, -1), (1, 0), (0, 1)))  # up, left, down, right
+
+    def getSlidingMoves(sky, row, col, moves, directions):
+        """
+        Add the moves of the rook, bishop or queen at row, col along the given directions.
+        A pinned piece only moves along its pin. The pin is read once, so a queen keeps it for all 8 directions.
+        """
+        pin_direction = None
+        for pin in sky.pins:
+            if pin[0] == row and pin[1] == col:
+                pin_direction = (pin[2], pin[3])
                 break
 
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
         enemy_color = "b" if sky.white_to_move else "w"
         for direction in directions:
+            if pin_direction is not None and pin_direction != direction and \
+                    pin_direction != (-direction[0], -direction[1]):
+                continue
             for i in range(1, 8):
                 end_row = row + direction[0] * i
                 end_col = col + direction[1] * i
                 if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check for possible moves only in boundaries of the board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = sky.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), sky.board))
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), sky.board))
-                            break
-                        else:  # friendly piece
-                            break
+                    end_piece = sky.board[end_row][end_col]
+                    if end_piece == "--":  # empty space is valid
+                        moves.append(Move((row, col), (end_row, end_col), sky.board))
+                    elif end_piece[0] == enemy_color:  # capture enemy piece
+                        moves.append(Move((row, col), (end_row, end_col), sky.board))
+                        break
+                    else:  # friendly piece
+                        break
                 else:  # off board
                     break
 
@@ -467,41 +970,14 @@ class GameState:
         """
         Get all the bishop moves for the bishop located at row col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(sky.pins) - 1, -1, -1):
-            if sky.pins[i][0] == row and sky.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (sky.pins[i][2], sky.pins[i][3])
-                sky.pins.remove(sky.pins[i])
-                break
-
-        directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # diagonals: up/left up/right down/right down/left
-        enemy_color = "b" if sky.white_to_move else "w"
-        for direction in directions:
-            for i in range(1, 8):
-                end_row = row + direction[0] * i
-                end_col = col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check if the move is on board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = sky.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), sky.board))
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), sky.board))
-                            break
-                        else:  # friendly piece
-                            break
-                else:  # off board
-                    break
+        # diagonals: up/left up/right down/right down/left
+        sky.getSlidingMoves(row, col, moves, ((-1, -1), (-1, 1), (1, 1), (1, -1)))
 
     def getQueenMoves(sky, row, col, moves):
         """
         Get all the queen moves for the queen located at row col and add the moves to the list.
         """
-        sky.getBishopMoves(row, col, moves)
-        sky.getRookMoves(row, col, moves)
+        sky.getSlidingMoves(row, col, moves, ((-1, -1), (-1, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (1, 0), (0, 1)))
 
     def getKingMoves(sky, row, col, moves):
         """
@@ -510,25 +986,20 @@ class GameState:
         row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
         col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = "w" if sky.white_to_move else "b"
+        enemy_color = "b" if sky.white_to_move else "w"
+        king = sky.board[row][col]
         for i in range(8):
             end_row = row + row_moves[i]
             end_col = col + col_moves[i]
             if 0 <= end_row <= 7 and 0 <= end_col <= 7:
                 end_piece = sky.board[end_row][end_col]
                 if end_piece[0] != ally_color:  # not an ally piece - empty or enemy
-                    # place king on end square and check for checks
-                    if ally_color == "w":
-                        sky.white_king_location = (end_row, end_col)
-                    else:
-                        sky.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = sky.checkForPinsAndChecks()
-                    if not in_check:
+                    # lift the king off its square so it doesn't block a slider attacking the square behind it
+                    sky.board[row][col] = "--"
+                    attacked = sky.squareAttackedBy(end_row, end_col, enemy_color)
+                    sky.board[row][col] = king
+                    if not attacked:
                         moves.append(Move((row, col), (end_row, end_col), sky.board))
-                    # place king back on original location
-                    if ally_color == "w":
-                        sky.white_king_location = (row, col)
-                    else:
-                        sky.black_king_location = (row, col)
 
     def getCastleMoves(sky, row, col, moves):
         """
@@ -561,6 +1032,12 @@ class CastleRights:
         sky.wqs = wqs
         sky.bqs = bqs
 
+    def index(sky):
+        """
+        The four rights packed into a number 0-15, used to look up Zobrist keys.
+        """
+        return sky.wks | sky.bks << 1 | sky.wqs << 2 | sky.bqs << 3
+
 
 class Move:
     # in chess, fields on the board are described by two symbols, one of them being number between 1-8 (which is corresponding to rows)
@@ -573,34 +1050,88 @@ class Move:
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
+    # a move is one packed integer: start square (bits 0-5), end square (bits 6-11) and flags (bits 12-14),
+    # a square being row * 8 + col; the moved and captured pieces are kept as references to the piece strings
+    __slots__ = ("code", "piece_moved", "piece_captured")
+    ENPASSANT_FLAG = 1 << 12
+    CASTLE_FLAG = 1 << 13
+    PROMOTION_FLAG = 1 << 14
+
     def __init__(sky, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False):
-        sky.start_row = start_square[0]
-        sky.start_col = start_square[1]
-        sky.end_row = end_square[0]
-        sky.end_col = end_square[1]
-        sky.piece_moved = board[sky.start_row][sky.start_col]
-        sky.piece_captured = board[sky.end_row][sky.end_col]
+        start_row, start_col = start_square
+        end_row, end_col = end_square
+        sky.piece_moved = board[start_row][start_col]
+        sky.piece_captured = board[end_row][end_col]
+        code = start_row * 8 + start_col | (end_row * 8 + end_col) << 6
         # pawn promotion
-        sky.is_pawn_promotion = (sky.piece_moved == "wp" and sky.end_row == 0) or (
-                sky.piece_moved == "bp" and sky.end_row == 7)
+        if sky.piece_moved[1] == "p" and (end_row == 0 or end_row == 7):
+            code |= Move.PROMOTION_FLAG
         # en passant
-        sky.is_enpassant_move = is_enpassant_move
-        if sky.is_enpassant_move:
+        if is_enpassant_move:
+            code |= Move.ENPASSANT_FLAG
             sky.piece_captured = "wp" if sky.piece_moved == "bp" else "bp"
         # castle move
-        sky.is_castle_move = is_castle_move
+        if is_castle_move:
+            code |= Move.CASTLE_FLAG
+        sky.code = code
+
+    @property
+    def start_row(sky):
+        return (sky.code >> 3) & 7
+
+    @property
+    def start_col(sky):
+        return sky.code & 7
+
+    @property
+    def end_row(sky):
+        return (sky.code >> 9) & 7
+
+    @property
+    def end_col(sky):
+        return (sky.code >> 6) & 7
+
+    @property
+    def is_pawn_promotion(sky):
+        return sky.code & Move.PROMOTION_FLAG != 0
+
+    @property
+    def is_enpassant_move(sky):
+        return sky.code & Move.ENPASSANT_FLAG != 0
+
+    @property
+    def is_castle_move(sky):
+        return sky.code & Move.CASTLE_FLAG != 0
+
+    @property
+    def is_capture(sky):
+        return sky.piece_captured != "--"
 
-        sky.is_capture = sky.piece_captured != "--"
-        sky.moveID = sky.start_row * 1000 + sky.start_col * 100 + sky.end_row * 10 + sky.end_col
+    @property
+    def moveID(sky):
+        """
+        Start and end square in 12 bits, identifies a move within a position.
+        """
+        return sky.code & 0xFFF
+
+    @staticmethod
+    def decodeID(move_id):
+        """
+        (start_row, start_col, end_row, end_col) of a moveID.
+        """
+        return (move_id >> 3) & 7, move_id & 7, (move_id >> 9) & 7, (move_id >> 6) & 7
 
     def __eq__(sky, other):
         """
         Overriding the equals method.
         """
         if isinstance(other, Move):
-            return sky.moveID == other.moveID
+            return sky.code & 0xFFF == other.code & 0xFFF
         return False
 
+    def __hash__(sky):
+        return sky.code & 0xFFF
+
     def getChessNotation(sky):
         if sky.is_pawn_promotion:
             return sky.getRankFile(sky.end_row, sky.end_col) + "Q"
@@ -629,6 +1160,13 @@ class Move:
     def getRankFile(sky, row, col):
         return sky.cols_to_files[col] + sky.rows_to_ranks[row]
 
+    def getLongNotation(sky):
+        """
+        Start and end square, plus "q" for a promotion, e.g. "e2e4" or "a7a8q".
+        """
+        notation = sky.getRankFile(sky.start_row, sky.start_col) + sky.getRankFile(sky.end_row, sky.end_col)
+        return notation + "q" if sky.is_pawn_promotion else notation
+
     def __str__(sky):
         if sky.is_castle_move:
             return "0-0" if sky.end_col == 6 else "0-0-0"
@@ -6,16 +6,22 @@ Displaying current GameStatus object.
 from pickle import FALSE
 import pygame as p
 import ChessEngine
+import ChessBitboard
 import ChessAI
+import ChessWorker
 import sys
-from multiprocessing import Process, Queue
+import time
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
 MOVE_LOG_PANEL_WIDTH = 250
 MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8
 SQUARE_SIZE = BOARD_HEIGHT // DIMENSION
-MAX_FPS = 10
+BOARD_COLORS = ("white", "gray")  # the top left square is always light
+ANIMATION_SECONDS_PER_SQUARE = 1 / 6  # time an animated piece takes to cross one square
+ANIMATION_FPS = 60  # frame rate while a move is animated, otherwise the loop sleeps until an event arrives
+AI_MOVE_READY = p.USEREVENT + 1  # posted by the engine worker's listener thread when a search result arrives
+PONDER = True  # the AI keeps searching on the human's time, on the reply it expects
 IMAGES = {}
 
 
@@ -40,12 +46,18 @@ def main():
     screen = p.display.set_mode(
         (BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
+    p.event.set_blocked(p.MOUSEMOTION)  # the loop has nothing to do on mouse moves, don't wake it for them
     screen.fill(p.Color("white"))
-    game_state = ChessEngine.GameState()
+    p.display.flip()
+    game_state = ChessBitboard.BitboardGameState()
     valid_moves = game_state.getValidMoves()
+    moves_by_square = movesByStartSquare(valid_moves)
     move_made = False  # flag variable for when a move is made
     animate = False  # flag variable for when we should animate a move
+    animation = None  # MoveAnimation running, if any
     loadImages()  # do this only once before while loop
+    renderer = BoardRenderer()
+    end_text_drawn = False
     running = True
     # no square is selected initially, this will keep track of the last click of the user (tuple(row,col))
     square_selected = ()
@@ -53,21 +65,35 @@ def main():
     game_over = False
     ai_thinking = False
     move_undone = False
-    move_finder_process = None
-    move_log_font = p.font.SysFont("Arial", 14, False, False)
+    # one AI process for the whole session, its results wake the loop up
+    engine_worker = ChessWorker.EngineWorker(on_result=lambda: p.event.post(p.event.Event(AI_MOVE_READY)))
+    move_log_panel = MoveLogPanel(p.font.SysFont("Arial", 14, False, False))
     player_one = False  # if a human is playing white, then this will be True, else False
     player_two = False  # if a hyman is playing white, then this will be True, else False
 
     while running:
         human_turn = (game_state.white_to_move and player_one) or (
             not game_state.white_to_move and player_two)
-        for e in p.event.get():
+        ai_to_start = not game_over and not human_turn and not move_undone and not ai_thinking
+        if animation is None and not ai_to_start:
+            events = [p.event.wait()] + p.event.get()  # nothing changes until an event, sleep until one comes
+        else:
+            events = p.event.get()
+        for e in events:
             if e.type == p.QUIT:
+                engine_worker.close()
                 p.quit()
                 sys.exit()
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED):  # the window needs to be drawn again
+                renderer.invalidate()
+                move_log_panel.invalidate()
+                end_text_drawn = False
             # mouse handler
+            elif e.type == p.MOUSEWHEEL:
+                if p.mouse.get_pos()[0] >= BOARD_WIDTH:
+                    move_log_panel.scroll(-e.y)
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not game_over:
+                if not game_over and e.button not in (4, 5):  # the wheel also sends buttons 4 and 5
                     location = p.mouse.get_pos()  # (x, y) location of the mouse
                     col = location[0] // SQUARE_SIZE
                     row = location[1] // SQUARE_SIZE
@@ -82,9 +108,9 @@ def main():
                     if len(player_clicks) == 2 and human_turn:  # after 2nd click
                         move = ChessEngine.Move(
                             player_clicks[0], player_clicks[1], game_state.board)
-                        for i in range(len(valid_moves)):
-                            if move == valid_moves[i]:
-                                game_state.makeMove(valid_moves[i])
+                        for valid_move in moves_by_square.get(player_clicks[0], ()):
+                            if move == valid_move:
+                                game_state.makeMove(valid_move)
                                 move_made = True
                                 animate = True
                                 square_selected = ()  # reset user clicks
@@ -99,120 +125,164 @@ def main():
                     move_made = True
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    engine_worker.cancel()  # stops a search or a ponder search
+                    ai_thinking = False
                     move_undone = True
                 if e.key == p.K_r:  # reset the game when 'r' is pressed
-                    game_state = ChessEngine.GameState()
+                    game_state = ChessBitboard.BitboardGameState()
                     valid_moves = game_state.getValidMoves()
+                    moves_by_square = movesByStartSquare(valid_moves)
                     square_selected = ()
                     player_clicks = []
                     move_made = False
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    engine_worker.cancel()
+                    ai_thinking = False
                     move_undone = True
 
         # AI move finder
         if not game_over and not human_turn and not move_undone:
             if not ai_thinking:
                 ai_thinking = True
-                return_queue = Queue()  # used to pass data between threads
-                move_finder_process = Process(target=ChessAI.findBestMove, args=(
-                    game_state, valid_moves, return_queue))
-                move_finder_process.start()
+                engine_worker.startSearch(game_state)  # goes on with the ponder search if the human played into it
 
-            if not move_finder_process.is_alive():
-                ai_move = return_queue.get()
+            search_result = engine_worker.poll(game_state)
+            if search_result is not None:
+                ai_move, search_depth, search_time = search_result
                 if ai_move is None:
                     ai_move = ChessAI.findRandomMove(valid_moves)
                 game_state.makeMove(ai_move)
                 move_made = True
                 animate = True
                 ai_thinking = False
+                human_next = (game_state.white_to_move and player_one) or (
+                    not game_state.white_to_move and player_two)
+                if PONDER and human_next:
+                    engine_worker.startPonder(game_state)
 
         if move_made:
+            if animation is not None:  # a newer move or an undo replaces it
+                animation = None
+                renderer.invalidate()
             if animate:
-                animateMove(game_state.move_log[-1],
-                            screen, game_state.board, clock)
+                animation = MoveAnimation(game_state.move_log[-1], game_state.board, renderer.background)
             valid_moves = game_state.getValidMoves()
+            moves_by_square = movesByStartSquare(valid_moves)
             move_made = False
             animate = False
             move_undone = False
 
-        drawGameState(screen, game_state, valid_moves, square_selected)
-
-        if not game_over:
-            drawMoveLog(screen, game_state, move_log_font)
-
+        dirty_rects = []
+        if animation is not None:
+            animation_rects, finished = animation.draw(screen)
+            dirty_rects += animation_rects
+            if finished:
+                animation = None
+                renderer.invalidate()
+        if animation is None:
+            if end_text_drawn and not (game_state.checkmate or game_state.stalemate or game_state.draw_reason):
+                renderer.invalidate()  # the text is drawn over the squares, they all have to come back
+                end_text_drawn = False
+            dirty_rects += renderer.draw(screen, game_state, moves_by_square, square_selected)
+
+        move_log_panel.update(game_state.move_log)
+        move_log_rect = move_log_panel.draw(screen)
+        if move_log_rect is not None:
+            dirty_rects.append(move_log_rect)
+
+        end_text = None
         if game_state.checkmate:
             game_over = True
-            if game_state.white_to_move:
-                drawEndGameText(screen, "Black wins by checkmate")
-            else:
-                drawEndGameText(screen, "White wins by checkmate")
-
+            end_text = "Black wins by checkmate" if game_state.white_to_move else "White wins by checkmate"
         elif game_state.stalemate:
             game_over = True
-            drawEndGameText(screen, "Stalemate")
-
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
+            end_text = "Stalemate"
+        elif game_state.draw_reason is not None:
+            game_over = True
+            end_text = "Draw by " + game_state.draw_reason
+        if end_text is not None and animation is None and (dirty_rects or not end_text_drawn):
+            dirty_rects.append(drawEndGameText(screen, end_text))
+            end_text_drawn = True
 
-def drawGameState(screen, game_state, valid_moves, square_selected):
-    """
-    Responsible for all the graphics within current game state.
-    """
-    drawBoard(screen)  # draw squares on the board
-    highlightSquares(screen, game_state, valid_moves, square_selected)
-    drawPieces(screen, game_state.board)  # draw pieces on top of those squares
+        if animation is not None:
+            clock.tick(ANIMATION_FPS)
+        if dirty_rects:
+            p.display.update(dirty_rects)
 
 
-def drawBoard(screen):
+class BoardRenderer:
     """
-    Draw the squares on the board.
-    The top left square is always light.
+    Draws the board with dirty rectangles. The squares are rendered once into a background surface,
+    and a square is redrawn only when its piece or highlight changed since it was last drawn.
+    draw returns the rectangles that changed, only those are sent to the display.
     """
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            color = colors[((row + column) % 2)]
-            p.draw.rect(screen, color, p.Rect(column * SQUARE_SIZE,
-                        row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
 
-
-def highlightSquares(screen, game_state, valid_moves, square_selected):
+    def __init__(sky):
+        sky.background = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        sky.rects = [p.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+                     for row in range(DIMENSION) for col in range(DIMENSION)]
+        for square, rect in enumerate(sky.rects):
+            sky.background.fill(p.Color(BOARD_COLORS[(square // DIMENSION + square % DIMENSION) % 2]), rect)
+        sky.overlays = []  # last move, selected square, move targets, drawn in this order
+        for color in ("green", "blue", "yellow"):
+            overlay = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
+            overlay.set_alpha(100)  # transparency value 0 -> transparent, 255 -> opaque
+            overlay.fill(p.Color(color))
+            sky.overlays.append(overlay)
+        sky.drawn = [None] * (DIMENSION * DIMENSION)  # (piece, last move, selected, target) on screen per square
+
+    def invalidate(sky):
+        """
+        Redraw every square on the next draw, after something else has drawn over the board.
+        """
+        sky.drawn = [None] * (DIMENSION * DIMENSION)
+
+    def draw(sky, screen, game_state, moves_by_square, square_selected):
+        """
+        Bring the board on screen up to game_state: the last move's end square, the selected square if it holds
+        a piece that can move and the end squares of that piece's moves are highlighted.
+        Returns the rectangles of the squares redrawn.
+        """
+        board = game_state.board
+        last_move_end = None
+        if len(game_state.move_log) > 0:
+            last_move = game_state.move_log[-1]
+            last_move_end = (last_move.end_row, last_move.end_col)
+        selected = None
+        targets = ()
+        if square_selected != () and board[square_selected[0]][square_selected[1]][0] == (
+                'w' if game_state.white_to_move else 'b'):
+            selected = square_selected
+            targets = {(move.end_row, move.end_col) for move in moves_by_square.get(square_selected, ())}
+        dirty = []
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                square = (row, col)
+                state = (board[row][col], square == last_move_end, square == selected, square in targets)
+                index = row * DIMENSION + col
+                if sky.drawn[index] == state:
+                    continue
+                sky.drawn[index] = state
+                rect = sky.rects[index]
+                screen.blit(sky.background, rect, rect)
+                for overlay, highlighted in zip(sky.overlays, state[1:]):
+                    if highlighted:
+                        screen.blit(overlay, rect)
+                if state[0] != "--":
+                    screen.blit(IMAGES[state[0]], rect)
+                dirty.append(rect)
+        return dirty
+
+
+def movesByStartSquare(valid_moves):
     """
-    Highlight square selected and moves for piece selected.
+    Index the legal moves by (row, col) of their start square.
     """
-    if (len(game_state.move_log)) > 0:
-        last_move = game_state.move_log[-1]
-        s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        s.set_alpha(100)
-        s.fill(p.Color('green'))
-        screen.blit(s, (last_move.end_col * SQUARE_SIZE,
-                    last_move.end_row * SQUARE_SIZE))
-    if square_selected != ():
-        row, col = square_selected
-        if game_state.board[row][col][0] == (
-                'w' if game_state.white_to_move else 'b'):  # square_selected is a piece that can be moved
-            # highlight selected square
-            s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            # transparency value 0 -> transparent, 255 -> opaque
-            s.set_alpha(100)
-            s.fill(p.Color('blue'))
-            screen.blit(s, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-            # highlight moves from that square
-            s.fill(p.Color('yellow'))
-            for move in valid_moves:
-                if move.start_row == row and move.start_col == col:
-                    screen.blit(s, (move.end_col * SQUARE_SIZE,
-                                move.end_row * SQUARE_SIZE))
+    moves_by_square = {}
+    for move in valid_moves:
+        moves_by_square.setdefault((move.start_row, move.start_col), []).append(move)
+    return moves_by_square
 
 
 def drawPieces(screen, board):
@@ -227,39 +297,93 @@ def drawPieces(screen, board):
                     column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
 
 
-def drawMoveLog(screen, game_state, font):
+class MoveLogPanel:
     """
-    Draws the move log.
-
+    The move log next to the board. Every line of moves is rendered to a surface once and kept:
+    a new move re-renders only the last line, an undo only the lines from the undone move on.
+    Only the lines that fit in the panel are drawn. The panel follows the latest move unless the
+    mouse wheel scrolled it back, scrolling down to the end follows again.
     """
-    move_log_rect = p.Rect(
-        BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color('black'), move_log_rect)
-    move_log = game_state.move_log
-    move_texts = []
-    for i in range(0, len(move_log), 2):
-        move_string = str(i // 2 + 1) + '. ' + str(move_log[i]) + " "
-        if i + 1 < len(move_log):
-            move_string += str(move_log[i + 1]) + "  "
-        move_texts.append(move_string)
-
-    moves_per_row = 3
-    padding = 5
-    line_spacing = 2
-    text_y = padding
-    for i in range(0, len(move_texts), moves_per_row):
+    MOVES_PER_ROW = 3  # full moves per line
+    PADDING = 5
+    LINE_SPACING = 2
+
+    def __init__(sky, font):
+        sky.font = font
+        sky.rect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
+        sky.line_height = font.get_height() + sky.LINE_SPACING
+        sky.visible_lines = max(1, (MOVE_LOG_PANEL_HEIGHT - sky.PADDING) // sky.line_height)
+        sky.moves = []  # the moves the lines were rendered from
+        sky.lines = []  # rendered surface of every line
+        sky.top_line = 0  # first line in view
+        sky.follow = True
+        sky.changed = True
+
+    def update(sky, move_log):
+        """
+        Re-render the lines from the first move that differs from the moves already rendered.
+        A game log only grows or shrinks at its end, so the moves are compared from the end back.
+        """
+        shared = min(len(move_log), len(sky.moves))
+        while shared > 0 and move_log[shared - 1] is not sky.moves[shared - 1]:
+            shared -= 1
+        if shared == len(move_log) == len(sky.moves):
+            return
+        del sky.moves[shared:]
+        sky.moves.extend(move_log[shared:])
+        plies_per_line = 2 * sky.MOVES_PER_ROW
+        first_line = shared // plies_per_line
+        del sky.lines[first_line:]
+        for line in range(first_line, (len(sky.moves) + plies_per_line - 1) // plies_per_line):
+            sky.lines.append(sky.font.render(sky.lineText(line), True, p.Color('white')))
+        sky.scroll(0)
+        sky.changed = True
+
+    def lineText(sky, line):
         text = ""
-        for j in range(moves_per_row):
-            if i + j < len(move_texts):
-                text += move_texts[i + j]
-
-        text_object = font.render(text, True, p.Color('white'))
-        text_location = move_log_rect.move(padding, text_y)
-        screen.blit(text_object, text_location)
-        text_y += text_object.get_height() + line_spacing
+        for i in range(line * 2 * sky.MOVES_PER_ROW, min((line + 1) * 2 * sky.MOVES_PER_ROW, len(sky.moves)), 2):
+            text += str(i // 2 + 1) + '. ' + str(sky.moves[i]) + " "
+            if i + 1 < len(sky.moves):
+                text += str(sky.moves[i + 1]) + "  "
+        return text
+
+    def invalidate(sky):
+        """
+        Draw the panel again on the next draw.
+        """
+        sky.changed = True
+
+    def scroll(sky, lines):
+        """
+        Scroll by lines, negative is back towards the first move.
+        """
+        last_top_line = max(0, len(sky.lines) - sky.visible_lines)
+        top_line = last_top_line if sky.follow and lines == 0 else min(max(sky.top_line + lines, 0), last_top_line)
+        sky.follow = top_line == last_top_line
+        if top_line != sky.top_line:
+            sky.top_line = top_line
+            sky.changed = True
+
+    def draw(sky, screen):
+        """
+        Draw the lines in view if anything changed since the last draw, returns the panel's rectangle then,
+        otherwise None.
+        """
+        if not sky.changed:
+            return None
+        sky.changed = False
+        p.draw.rect(screen, p.Color('black'), sky.rect)
+        text_y = sky.PADDING
+        for text_object in sky.lines[sky.top_line:sky.top_line + sky.visible_lines]:
+            screen.blit(text_object, sky.rect.move(sky.PADDING, text_y))
+            text_y += sky.line_height
+        return sky.rect
 
 
 def drawEndGameText(screen, text):
+    """
+    Draw text in the middle of the board, returns the rectangle of the board.
+    """
     font = p.font.SysFont("Helvetica", 32, True, False)
     text_object = font.render(text, False, p.Color("gray"))
     text_location = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT).move(BOARD_WIDTH / 2 - text_object.get_width() / 2,
@@ -267,27 +391,25 @@ def drawEndGameText(screen, text):
     screen.blit(text_object, text_location)
     text_object = font.render(text, False, p.Color('black'))
     screen.blit(text_object, text_location.move(2, 2))
+    return p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT)
 
 
-def animateMove(move, screen, board, clock):
+class MoveAnimation:
     """
-    Animating a move
+    Slides the moved piece from its start square to its end square, one step per call of draw, so the main loop
+    keeps handling input and the AI while it runs. The board without the moving piece is captured once,
+    each frame restores the sprite's previous rectangle from it and blits the sprite at its new place.
+    The position follows the time since the start, so a slow frame makes the piece jump ahead instead of
+    making the animation last longer.
     """
-    global colors
-    d_row = move.end_row - move.start_row
-    d_col = move.end_col - move.start_col
-    frames_per_square = 10  # frames to move one square
-    frame_count = (abs(d_row) + abs(d_col)) * frames_per_square
-    for frame in range(frame_count + 1):
-        row, col = (move.start_row + d_row * frame / frame_count,
-                    move.start_col + d_col * frame / frame_count)
-        drawBoard(screen)
-        drawPieces(screen, board)
+
+    def __init__(sky, move, board, background):
+        sky.move = move
+        sky.static = background.copy()
+        drawPieces(sky.static, board)
         # erase the piece moved from its ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col * SQUARE_SIZE,
-                            move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        p.draw.rect(screen, color, end_square)
+        end_square = p.Rect(move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        sky.static.blit(background, end_square, end_square)
         # draw captured piece onto rectangle
         if move.piece_captured != '--':
             if move.is_enpassant_move:
@@ -295,12 +417,27 @@ def animateMove(move, screen, board, clock):
                     1 if move.piece_captured[0] == 'b' else move.end_row - 1
                 end_square = p.Rect(
                     move.end_col * SQUARE_SIZE, enpassant_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-            screen.blit(IMAGES[move.piece_captured], end_square)
-        # draw moving piece
-        screen.blit(IMAGES[move.piece_moved], p.Rect(
-            col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        p.display.flip()
-        clock.tick(60)
+            sky.static.blit(IMAGES[move.piece_captured], end_square)
+        sky.duration = (abs(move.end_row - move.start_row) + abs(move.end_col - move.start_col)) * \
+            ANIMATION_SECONDS_PER_SQUARE
+        sky.start_time = time.perf_counter()
+        sky.sprite_rect = None  # where the sprite was drawn last frame
+
+    def draw(sky, screen):
+        """
+        Draw the next frame, returns (rectangles changed, True once the piece has arrived).
+        """
+        move = sky.move
+        progress = min(1.0, (time.perf_counter() - sky.start_time) / sky.duration) if sky.duration > 0 else 1.0
+        if sky.sprite_rect is None:  # first frame
+            dirty = [screen.blit(sky.static, (0, 0))]
+        else:
+            dirty = [screen.blit(sky.static, sky.sprite_rect, sky.sprite_rect)]
+        row = move.start_row + (move.end_row - move.start_row) * progress
+        col = move.start_col + (move.end_col - move.start_col) * progress
+        sky.sprite_rect = p.Rect(round(col * SQUARE_SIZE), round(row * SQUARE_SIZE), SQUARE_SIZE, SQUARE_SIZE)
+        dirty.append(screen.blit(IMAGES[move.piece_moved], sky.sprite_rect))
+        return dirty, progress >= 1.0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+"""
+Perft: counting the leaf nodes of the legal move tree down to a fixed depth.
+Checks getValidMoves/makeMove/undoMove against known node counts and measures their speed, without pygame.
+
+    python ChessPerft.py                              all standard positions, compared with the expected counts
+    python ChessPerft.py -p kiwipete -d 4 --divide    node count below every root move
+    python ChessPerft.py --fen "<fen>" -d 5 --hash 64 --processes 4
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+from array import array
+import ChessEngine
+import ChessBitboard
+
+# standard perft positions with their node counts at depth 1, 2, 3, ...
+# the engine only promotes to a queen, so these counts leave out under-promotions
+# and are lower than the published ones wherever a promotion is possible
+POSITIONS = {
+    "start": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+              [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4074224]),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  [14, 191, 2812, 43238, 674624]),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  [6, 228, 8087, 320802]),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  [41, 1373, 54007, 1806790]),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                  [46, 2079, 89890, 3894594]),
+}
+DEFAULT_DEPTH = 3
+
+
+class PerftTable:
+    """
+    Node counts of positions already counted, indexed by Zobrist key and remaining depth.
+    Every entry takes 16 bytes in two flat arrays: the full key, and the count shifted left 8 bits with the depth below.
+    Entries are always replaced, a lost count only means counting that subtree again.
+    """
+    ENTRY_SIZE = 16
+
+    def __init__(sky, size_mb):
+        entries = 1
+        while entries * 2 * PerftTable.ENTRY_SIZE <= size_mb * 1024 * 1024:
+            entries *= 2
+        sky.mask = entries - 1
+        sky.keys = array("Q", bytes(8 * entries))
+        sky.data = array("Q", bytes(8 * entries))
+
+    def probe(sky, key, depth):
+        """
+        The stored node count of the position at this depth, or None.
+        """
+        index = (key ^ depth) & sky.mask
+        data = sky.data[index]
+        if sky.keys[index] == key and data & 0xFF == depth:
+            return data >> 8
+        return None
+
+    def store(sky, key, depth, nodes):
+        index = (key ^ depth) & sky.mask
+        sky.keys[index] = key
+        sky.data[index] = nodes << 8 | depth
+
+
+def perft(game_state, depth, table=None):
+    """
+    Number of leaf nodes of the legal move tree depth plies below the current position.
+    The last ply is counted without making the moves.
+    """
+    if depth == 0:
+        return 1
+    if table is not None and depth > 1:
+        nodes = table.probe(game_state.zobrist_key, depth)
+        if nodes is not None:
+            return nodes
+    moves = game_state.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game_state.makeMove(move)
+        nodes += perft(game_state, depth - 1, table)
+        game_state.undoMove()
+    if table is not None:
+        table.store(game_state.zobrist_key, depth, nodes)
+    return nodes
+
+
+# every worker process keeps its own table, so later root moves reuse what earlier ones counted
+worker_table = None
+
+
+def startWorker(hash_size_mb):
+    global worker_table
+    worker_table = PerftTable(hash_size_mb) if hash_size_mb else None
+
+
+def perftAfterMove(task):
+    """
+    Pool task: node count of the subtree below one root move, given as (fen, moveID, depth, game state class).
+    """
+    fen, move_id, depth, state_class = task
+    game_state = state_class()
+    game_state.loadFEN(fen)
+    game_state.makeMove(game_state.getMoveByID(move_id))
+    return move_id, perft(game_state, depth - 1, worker_table)
+
+
+def divide(fen, depth, hash_size_mb=0, processes=1, state_class=ChessBitboard.BitboardGameState):
+    """
+    Perft split by root move: a list of (move, node count) in notation order.
+    With more than one process the root moves are shared out over a process pool.
+    """
+    game_state = state_class()
+    game_state.loadFEN(fen)
+    moves = game_state.getValidMoves()
+    if depth <= 1:
+        return sorted(((move, 1) for move in moves), key=lambda result: result[0].getLongNotation())
+    counts = {}
+    if processes > 1:
+        tasks = [(fen, move.moveID, depth, state_class) for move in moves]
+        with multiprocessing.Pool(processes, startWorker, (hash_size_mb,)) as pool:
+            for move_id, nodes in pool.imap_unordered(perftAfterMove, tasks):
+                counts[move_id] = nodes
+    else:
+        table = PerftTable(hash_size_mb) if hash_size_mb else None
+        for move in moves:
+            game_state.makeMove(move)
+            counts[move.moveID] = perft(game_state, depth - 1, table)
+            game_state.undoMove()
+    return sorted(((move, counts[move.moveID]) for move in moves), key=lambda result: result[0].getLongNotation())
+
+
+def runPerft(name, fen, depth, hash_size_mb=0, processes=1, state_class=ChessBitboard.BitboardGameState,
+             show_divide=False, expected=None):
+    """
+    Count one position and print nodes, elapsed time and nodes per second.
+    Returns False if expected is given and the count differs from it.
+    """
+    start_time = time.perf_counter()
+    results = divide(fen, depth, hash_size_mb, processes, state_class)
+    elapsed = time.perf_counter() - start_time
+    nodes = sum(nodes for move, nodes in results)
+    if show_divide:
+        for move, move_nodes in results:
+            print("  " + move.getLongNotation() + ": " + str(move_nodes))
+    line = "{} depth {}: {} nodes in {:.2f}s, {:.0f} nodes/s".format(name, depth, nodes, elapsed,
+                                                                   nodes / elapsed if elapsed > 0 else 0)
+    if expected is not None:
+        line += "  OK" if nodes == expected else "  FAILED, expected " + str(expected)
+    print(line, flush=True)
+    return expected is None or nodes == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft node counts of the chess move generator.")
+    parser.add_argument("-p", "--position", choices=sorted(POSITIONS), action="append",
+                        help="standard position to count, can be repeated (default: all of them)")
+    parser.add_argument("--fen", help="count this position instead of the standard ones")
+    parser.add_argument("-d", "--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--divide", action="store_true", help="print the node count below every root move")
+    parser.add_argument("--hash", type=int, default=0, metavar="MB", help="reuse counts of transpositions (default: off)")
+    parser.add_argument("--processes", type=int, default=1, help="split the root moves over this many processes")
+    parser.add_argument("--mailbox", action="store_true", help="use the 8x8 board move generator instead of bitboards")
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error("depth must be at least 1")
+
+    state_class = ChessEngine.GameState if args.mailbox else ChessBitboard.BitboardGameState
+    if args.fen:
+        try:
+            state_class().loadFEN(args.fen)
+        except ValueError as error:
+            parser.error(str(error))
+        runPerft("fen", args.fen, args.depth, args.hash, args.processes, state_class, args.divide)
+        return
+    passed = True
+    for name in args.position or POSITIONS:
+        fen, counts = POSITIONS[name]
+        expected = counts[args.depth - 1] if args.depth <= len(counts) else None
+        passed &= runPerft(name, fen, args.depth, args.hash, args.processes, state_class, args.divide, expected)
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
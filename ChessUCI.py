@@ -0,0 +1,231 @@
+"""
+UCI front end, for running the engine under a chess GUI or match manager without a window:
+
+    python ChessUCI.py
+
+Supports uci, isready, ucinewgame, setoption (Hash, Threads, OwnBook), position, go (wtime, btime, winc, binc,
+movestogo, movetime, depth, nodes, infinite), stop and quit.
+Commands are read on the main thread while the search runs on its own, so stop and isready are answered mid-search.
+Nothing here imports pygame.
+"""
+import queue
+import sys
+import threading
+import ChessAI
+import ChessBitboard
+
+ENGINE_NAME = "Chess_Project"
+ENGINE_AUTHOR = "Chess_Project contributors"
+MOVES_TO_GO = 30  # moves left to share the clock among when the GUI doesn't say
+MOVE_OVERHEAD = 0.05  # seconds kept back from every move for the GUI and the pipe
+MAX_HASH_MB = 1024
+MAX_THREADS = 64
+
+
+def timeForMove(remaining, increment=0.0, moves_to_go=None):
+    """
+    Seconds to spend on a move with remaining seconds on the clock and increment added after it.
+    """
+    budget = remaining / (moves_to_go or MOVES_TO_GO) + increment
+    return max(0.01, min(budget, remaining / 2) - MOVE_OVERHEAD)
+
+
+def scoreText(score, depth):
+    """
+    UCI score of a search score for the side to move. The search doesn't track mate distances,
+    a mate found at depth plies is given as mate within that many moves.
+    """
+    if abs(score) >= ChessAI.CHECKMATE:
+        moves = (depth + 1) // 2
+        return "mate {}".format(moves if score > 0 else -moves)
+    return "cp {}".format(round(score * 100))
+
+
+class UCIEngine:
+    """
+    State of the UCI session: the position, the options and the search running on its thread, if any.
+    """
+
+    def __init__(sky, output=sys.stdout):
+        sky.output = output
+        sky.output_lock = threading.Lock()  # info lines come from the search thread, replies from the main thread
+        sky.game_state = ChessBitboard.BitboardGameState()
+        sky.workers = ChessAI.WORKERS
+        sky.stop_event = threading.Event()
+        ChessAI.stop_event = sky.stop_event  # countNode polls it, a stopped search ends like one out of time
+        sky.search_thread = None
+        sky.startHelpers()
+
+    def send(sky, line):
+        with sky.output_lock:
+            sky.output.write(line + "\n")
+            sky.output.flush()
+
+    def command(sky, line):
+        """
+        Handle one line from the GUI, return False on quit.
+        """
+        words = line.split()
+        if not words:
+            return True
+        name, args = words[0], words[1:]
+        if name == "uci":
+            sky.send("id name " + ENGINE_NAME)
+            sky.send("id author " + ENGINE_AUTHOR)
+            sky.send("option name Hash type spin default {} min 1 max {}".format(ChessAI.HASH_SIZE_MB, MAX_HASH_MB))
+            sky.send("option name Threads type spin default {} min 1 max {}".format(ChessAI.WORKERS, MAX_THREADS))
+            sky.send("option name OwnBook type check default {}".format(
+                "true" if ChessAI.opening_book is not None else "false"))
+            sky.send("uciok")
+        elif name == "isready":
+            sky.send("readyok")
+        elif name == "setoption":
+            sky.setOption(args)
+        elif name == "ucinewgame":
+            sky.stop()
+            ChessAI.transposition_table.clear()
+            sky.game_state = ChessBitboard.BitboardGameState()
+        elif name == "position":
+            sky.stop()
+            sky.position(args)
+        elif name == "go":
+            sky.go(args)
+        elif name == "stop":
+            sky.stop()
+        elif name == "quit":
+            sky.stop()
+            return False
+        return True
+
+    def setOption(sky, args):
+        """
+        setoption name <name> value <value>
+        """
+        if "name" not in args:
+            return
+        value_index = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1:value_index]).lower()
+        value = " ".join(args[value_index + 1:])
+        try:
+            if name == "hash":
+                ChessAI.setHashSize(min(max(int(value), 1), MAX_HASH_MB))
+                sky.startHelpers()
+            elif name == "threads":
+                sky.workers = min(max(int(value), 1), MAX_THREADS)
+                sky.startHelpers()
+            elif name == "ownbook":
+                ChessAI.setBook(ChessAI.BOOK_PATH if value.lower() == "true" else None)
+            else:
+                sky.send("info string unknown option " + name)
+        except (ValueError, OSError) as error:
+            sky.send("info string bad value for {}: {}".format(name, error))
+
+    def startHelpers(sky):
+        """
+        Start the helper processes of the parallel search now, on the main thread. A process forked by the search
+        thread while this one waits in a read of stdin gets stuck closing its copy of stdin and never searches.
+        """
+        if sky.workers > 1:
+            ChessAI.helperPool(sky.workers)
+
+    def position(sky, args):
+        """
+        position startpos|fen <fen> [moves <move> ...], moves in long algebraic notation.
+        """
+        moves_index = args.index("moves") if "moves" in args else len(args)
+        game_state = ChessBitboard.BitboardGameState()
+        if args and args[0] == "fen":
+            try:
+                game_state.loadFEN(" ".join(args[1:moves_index]))
+            except ValueError as error:
+                sky.send("info string " + str(error))
+                return
+        for notation in args[moves_index + 1:]:
+            move = sky.findMove(game_state, notation)
+            if move is None:
+                sky.send("info string illegal move " + notation)
+                break
+            game_state.makeMove(move)
+        sky.game_state = game_state
+
+    def findMove(sky, game_state, notation):
+        notation = notation.lower()
+        for move in game_state.getValidMoves():
+            if move.getLongNotation() == notation:
+                return move
+        if len(notation) == 5:
+            # the engine only promotes to a queen, an under-promotion is played as one
+            for move in game_state.getValidMoves():
+                if move.getLongNotation() == notation[:4] + "q":
+                    sky.send("info string {} played as a queen promotion".format(notation))
+                    return move
+        return None
+
+    def go(sky, args):
+        """
+        Start searching the current position on the search thread, bestmove is sent when it ends.
+        """
+        sky.stop()
+        options = {}
+        infinite = False
+        for index, word in enumerate(args):
+            if word == "infinite":
+                infinite = True
+            elif word in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes") and \
+                    index + 1 < len(args):
+                try:
+                    options[word] = int(args[index + 1])
+                except ValueError:
+                    pass
+        white = sky.game_state.white_to_move
+        time_limit = ChessAI.TIME_LIMIT
+        if infinite or "depth" in options or "nodes" in options:
+            time_limit = None
+        if "movetime" in options:
+            time_limit = max(0.01, options["movetime"] / 1000 - MOVE_OVERHEAD)
+        elif ("wtime" if white else "btime") in options:
+            time_limit = timeForMove(options["wtime" if white else "btime"] / 1000,
+                                     options.get("winc" if white else "binc", 0) / 1000, options.get("movestogo"))
+        max_depth = min(options.get("depth", ChessAI.MAX_DEPTH), ChessAI.MAX_DEPTH)
+        node_limit = options.get("nodes")
+        sky.stop_event.clear()
+        sky.search_thread = threading.Thread(target=sky.search, daemon=True,
+                                             args=(sky.game_state, time_limit, node_limit, max_depth, infinite))
+        sky.search_thread.start()
+
+    def search(sky, game_state, time_limit, node_limit, max_depth, infinite):
+        """
+        Body of the search thread.
+        """
+        def report(depth, score, nodes, elapsed, move):
+            sky.send("info depth {} score {} nodes {} nps {} time {} pv {}".format(
+                depth, scoreText(score, depth), nodes, int(nodes / elapsed) if elapsed > 0 else 0,
+                int(elapsed * 1000), move.getLongNotation()))
+
+        return_queue = queue.Queue()
+        ChessAI.findBestMoveParallel(game_state, game_state.getValidMoves(), return_queue, time_limit, node_limit,
+                                     max_depth, report, sky.workers)
+        best_move = return_queue.get()[0]
+        if infinite:  # bestmove only once the GUI says stop, even if the search ended by itself
+            sky.stop_event.wait()
+        sky.send("bestmove " + (best_move.getLongNotation() if best_move is not None else "0000"))
+
+    def stop(sky):
+        """
+        End the running search, if any, and wait for its bestmove.
+        """
+        if sky.search_thread is not None:
+            sky.stop_event.set()
+            sky.search_thread.join()
+            sky.search_thread = None
+
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.command(line):
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Long-lived AI process.
+The GUI keeps one EngineWorker for the whole session instead of starting a process per AI move:
+the worker holds its own copy of the game, is sent only the moves played since the last search,
+and keeps its transposition table and move ordering tables warm from one move to the next.
+A search can be cancelled, the worker then answers with the best move found so far.
+While the opponent thinks the worker can ponder: search the position after the reply it expects, and carry on
+with that search as the real one if the opponent does play that reply.
+"""
+import atexit
+import queue
+import threading
+import time
+from multiprocessing import Process, Queue, Value
+import ChessAI
+import ChessBitboard
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+class CancelFlag:
+    """
+    Stop flag of the worker's searches, set when the search being run is the one the GUI cancelled.
+    Comparing search ids means a cancel that arrives too late never stops the search after it.
+    A ponder search has no deadline until the GUI reports the ponder hit, then it gets its time limit from that moment.
+    """
+
+    def __init__(sky, cancelled_search, ponder_hit_search):
+        sky.cancelled_search = cancelled_search
+        sky.ponder_hit_search = ponder_hit_search
+        sky.search_id = 0
+        sky.ponder_time_limit = None  # time limit of the ponder search being run, applied on the hit
+        sky.pondering = False
+
+    def is_set(sky):
+        if sky.pondering and sky.ponder_hit_search.value == sky.search_id:
+            sky.pondering = False
+            if sky.ponder_time_limit is not None:
+                ChessAI.deadline = time.perf_counter() + sky.ponder_time_limit
+        return sky.cancelled_search.value == sky.search_id
+
+
+def workerLoop(commands, results, cancelled_search, ponder_hit_search):
+    """
+    Body of the worker process: apply commands until "quit" arrives.
+    ("new", fen) starts a new game, ("moves", [moveID, ...]) and ("undo", count) bring the game up to date,
+    ("search", search id, time limit, node limit, max depth) puts
+    ("bestmove", search id, moveID, depth, seconds, moveID of the expected reply) on results when done.
+    ("ponder", search id, time limit, node limit, max depth) is a search with no deadline until the ponder hit.
+    """
+    cancel_flag = CancelFlag(cancelled_search, ponder_hit_search)
+    ChessAI.stop_event = cancel_flag  # countNode polls it, a cancelled search ends like one out of time
+    game_state = ChessBitboard.BitboardGameState()
+    while True:
+        command = commands.get()
+        if command[0] == "new":
+            game_state.loadFEN(command[1])
+        elif command[0] == "moves":
+            for move_id in command[1]:
+                game_state.makeMove(game_state.getMoveByID(move_id))
+        elif command[0] == "undo":
+            for undo in range(command[1]):
+                game_state.undoMove()
+        elif command[0] in ("search", "ponder"):
+            search_id, time_limit, node_limit, max_depth = command[1:]
+            cancel_flag.search_id = search_id
+            cancel_flag.pondering = command[0] == "ponder"
+            cancel_flag.ponder_time_limit = time_limit
+            return_queue = queue.Queue()
+            ChessAI.findBestMoveParallel(game_state, game_state.getValidMoves(), return_queue,
+                                         None if cancel_flag.pondering else time_limit, node_limit, max_depth)
+            best_move, depth_reached, elapsed = return_queue.get()
+            reply = None if best_move is None else ChessAI.expectedReply(game_state, best_move)
+            results.put(("bestmove", search_id, None if best_move is None else best_move.moveID,
+                         depth_reached, elapsed, None if reply is None else reply.moveID))
+        elif command[0] == "quit":
+            break
+
+
+class EngineWorker:
+    """
+    Handle of the worker process, used by the GUI.
+    """
+
+    def __init__(sky, fen=START_FEN, on_result=None):
+        """
+        on_result, if given, is called from a listener thread whenever a result arrives, so a GUI can sleep
+        until then instead of polling.
+        """
+        sky.commands = Queue()
+        sky.results = Queue()
+        sky.ready = queue.Queue()  # results moved over from the worker by the listener thread
+        sky.on_result = on_result
+        sky.cancelled_search = Value("q", 0, lock=False)
+        sky.ponder_hit_search = Value("q", 0, lock=False)
+        # not a daemon, a parallel search starts helper processes of its own
+        sky.process = Process(target=workerLoop, args=(sky.commands, sky.results, sky.cancelled_search,
+                                                       sky.ponder_hit_search))
+        sky.process.start()
+        threading.Thread(target=sky.listen, daemon=True).start()
+        sky.synced_move_ids = []  # moves the worker has played on top of its start position
+        sky.search_id = 0
+        sky.expected_reply_id = None  # moveID of the reply the latest finished search expects
+        sky.pondering = False
+        sky.newGame(fen)
+        atexit.register(sky.close)
+
+    def listen(sky):
+        """
+        Body of the listener thread: hand every result of the worker to poll and call on_result.
+        """
+        while True:
+            result = sky.results.get()
+            if result is None:  # the worker is closed
+                break
+            sky.ready.put(result)
+            if sky.on_result is not None:
+                sky.on_result()
+
+    def newGame(sky, fen=START_FEN):
+        sky.cancel()
+        sky.commands.put(("new", fen))
+        sky.synced_move_ids = []
+
+    def sync(sky, game_state):
+        """
+        Bring the worker's game up to game_state, sending only what changed: undos back to the last move
+        both games share, then the moves after it.
+        """
+        move_ids = [move.moveID for move in game_state.move_log]
+        shared = 0
+        while shared < min(len(move_ids), len(sky.synced_move_ids)) and \
+                move_ids[shared] == sky.synced_move_ids[shared]:
+            shared += 1
+        if shared < len(sky.synced_move_ids):
+            sky.commands.put(("undo", len(sky.synced_move_ids) - shared))
+        if shared < len(move_ids):
+            sky.commands.put(("moves", move_ids[shared:]))
+        sky.synced_move_ids = move_ids
+
+    def startSearch(sky, game_state, time_limit=ChessAI.TIME_LIMIT, node_limit=ChessAI.NODE_LIMIT,
+                    max_depth=ChessAI.MAX_DEPTH):
+        """
+        Search the position of game_state, the result is picked up with poll.
+        A search still running is cancelled first and its result thrown away, unless it is a ponder search of this
+        very position: then that search goes on as the search for the move, its time limit counted from now.
+        """
+        if sky.pondering and [move.moveID for move in game_state.move_log] == sky.synced_move_ids:
+            sky.pondering = False
+            sky.ponder_hit_search.value = sky.search_id
+            return
+        sky.cancel()
+        sky.sync(game_state)
+        sky.search_id += 1
+        sky.commands.put(("search", sky.search_id, time_limit, node_limit, max_depth))
+
+    def startPonder(sky, game_state, time_limit=ChessAI.TIME_LIMIT, node_limit=ChessAI.NODE_LIMIT,
+                    max_depth=ChessAI.MAX_DEPTH):
+        """
+        On the opponent's time, search the position after the reply the last search expected.
+        The transposition table it fills is kept if the opponent plays something else.
+        Returns False if there is no expected reply to ponder on.
+        """
+        if sky.expected_reply_id is None or game_state.getMoveByID(sky.expected_reply_id) is None:
+            return False
+        sky.cancel()
+        sky.sync(game_state)
+        sky.commands.put(("moves", [sky.expected_reply_id]))
+        sky.synced_move_ids = sky.synced_move_ids + [sky.expected_reply_id]
+        sky.search_id += 1
+        sky.commands.put(("ponder", sky.search_id, time_limit, node_limit, max_depth))
+        sky.pondering = True
+        return True
+
+    def cancel(sky):
+        """
+        Stop the current search early, poll then returns the best move it found so far.
+        """
+        sky.cancelled_search.value = sky.search_id
+        sky.pondering = False
+
+    def poll(sky, game_state):
+        """
+        (best move, depth reached, seconds used) of the latest search once it is done, otherwise None.
+        game_state has to be in the searched position, the move is looked up in it.
+        """
+        if sky.pondering:
+            return None  # a ponder search answers only after the ponder hit
+        while True:
+            try:
+                result, search_id, move_id, depth_reached, elapsed, reply_id = sky.ready.get_nowait()
+            except queue.Empty:
+                return None
+            if search_id == sky.search_id:  # results of earlier, cancelled searches are dropped
+                sky.expected_reply_id = reply_id
+                move = None if move_id is None else game_state.getMoveByID(move_id)
+                return move, depth_reached, elapsed
+
+    def close(sky):
+        if sky.process.is_alive():
+            sky.cancel()
+            sky.commands.put(("quit",))
+            sky.process.join(5)
+            if sky.process.is_alive():
+                sky.process.terminate()
+            sky.results.put(None)  # ends the listener thread
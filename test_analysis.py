@@ -0,0 +1,33 @@
+"""
+Results and errors of the batch analysis of single lines.
+"""
+import ChessAI
+import ChessAnalysis
+
+
+def analyse(line):
+    ChessAnalysis.startWorker(1)
+    return ChessAnalysis.analysePosition((7, line, None, None, 2))
+
+
+def test_solved_position():
+    result = analyse('6k1/5ppp/8/8/8/8/8/K3R3 w - - bm Re8#; id "back rank";')
+    assert result["line"] == 7
+    assert result["id"] == "back rank"
+    assert result["move"] == "e1e8"
+    assert result["solved"]
+
+
+def test_invalid_position():
+    for line in ("8/8/8/8 w - -", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQQBNR w KQkq - 0 1"):
+        assert analyse(line)["error"].startswith("invalid position: " + line)
+
+
+def test_search_failure_is_not_an_invalid_position(monkeypatch):
+    def failingSearch(*args):
+        raise KeyError("wK")
+
+    monkeypatch.setattr(ChessAI, "findBestMove", failingSearch)
+    result = analyse("6k1/5ppp/8/8/8/8/8/K3R3 w - - 0 1")
+    assert result["fen"] == "6k1/5ppp/8/8/8/8/8/K3R3 w - - 0 1"
+    assert result["error"] == "search failed: KeyError: 'wK'"
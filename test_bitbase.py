@@ -0,0 +1,59 @@
+"""
+Generating and probing the KRvK bitbase.
+"""
+import pytest
+import ChessBitbase
+import ChessEngine
+
+
+@pytest.fixture(scope="module")
+def krvk_log(tmp_path_factory):
+    """
+    Generate KRvK with distances to mate into an empty directory, about 3 minutes, and probe it for the tests.
+    """
+    log = []
+    ChessBitbase.setBitbaseDir(str(tmp_path_factory.mktemp("bitbases")))
+    try:
+        ChessBitbase.generateBitbase("KRvK", log=log.append)
+        yield log
+    finally:
+        ChessBitbase.setBitbaseDir(ChessBitbase.BITBASE_DIR)
+
+
+def probe(fen):
+    game_state = ChessEngine.GameState()
+    game_state.loadFEN(fen)
+    return ChessBitbase.probe(game_state)
+
+
+def test_generate_krvk(krvk_log):
+    assert krvk_log[-1].startswith("KRvK: 175168 won, 201700 lost, 22244 drawn, longest mate 32 plies")
+
+
+@pytest.mark.parametrize("fen, entry", [
+    ("k7/8/1K6/8/8/8/8/7R w - - 0 1", (ChessBitbase.WIN, 1)),  # Rh8#
+    ("k7/8/1K6/8/8/8/8/7R b - - 0 1", (ChessBitbase.LOSS, 2)),
+    ("7r/8/8/8/8/1k6/8/K7 b - - 0 1", (ChessBitbase.WIN, 1)),  # the mirrored table entry, Rh1#
+    ("k7/1R6/2K5/8/8/8/8/8 b - - 0 1", (ChessBitbase.DRAW, None)),  # stalemate
+    ("k7/1R6/8/8/8/8/8/7K b - - 0 1", (ChessBitbase.DRAW, None)),  # the rook hangs
+    ("8/8/8/3k4/8/8/8/R3K3 w Q - 0 1", None),  # castling rights are in no table
+    ("8/8/8/3k4/8/8/8/R3K2N w - - 0 1", None)])  # 4 men
+def test_probe(krvk_log, fen, entry):
+    assert probe(fen) == entry
+
+
+def test_best_move(krvk_log):
+    for fen, best_move in (("k7/8/1K6/8/8/8/8/7R w - - 0 1", "h1h8"),
+                           ("k7/1R6/8/8/8/8/8/7K b - - 0 1", "a8b7")):
+        game_state = ChessEngine.GameState()
+        game_state.loadFEN(fen)
+        assert ChessBitbase.bestMove(game_state).getLongNotation() == best_move
+    # following the table from any won position mates in exactly its distance
+    game_state = ChessEngine.GameState()
+    game_state.loadFEN("8/8/8/3k4/8/8/8/R3K3 w - - 0 1")
+    result, distance = ChessBitbase.probe(game_state)
+    assert result == ChessBitbase.WIN
+    for ply in range(distance):
+        game_state.makeMove(ChessBitbase.bestMove(game_state))
+    game_state.getValidMoves()
+    assert game_state.checkmate
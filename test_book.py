@@ -0,0 +1,61 @@
+"""
+Polyglot keys, move codes and book lookups.
+"""
+import pytest
+import ChessBitboard
+import ChessBook
+import ChessEngine
+
+# keys given in the Polyglot format description
+POLYGLOT_KEYS = [([], 0x463b96181691fc9c),
+                 (["e4"], 0x823c9b50fd114196),
+                 (["e4", "d5"], 0x0756b94461c50fb0),
+                 (["e4", "d5", "e5"], 0x662fafb965db29d4),
+                 (["e4", "d5", "e5", "f5"], 0x22a48b5a8e47ff78),
+                 (["e4", "d5", "e5", "f5", "Ke2"], 0x652a607ca3f242c1),
+                 (["e4", "d5", "e5", "f5", "Ke2", "Kf7"], 0x00fdd303c946bdd9),
+                 (["a4", "b5", "h4", "b4", "c4"], 0x3c8123ea7b067637),
+                 (["a4", "b5", "h4", "b4", "c4", "bxc3", "Ra3"], 0x5c3f9b829b279560)]
+
+
+@pytest.mark.parametrize("state_class", [ChessEngine.GameState, ChessBitboard.BitboardGameState],
+                         ids=["mailbox", "bitboard"])
+@pytest.mark.parametrize("moves, key", POLYGLOT_KEYS)
+def test_polyglot_key(moves, key, state_class):
+    game_state = state_class()
+    for san in moves:
+        game_state.makeMove(game_state.getMoveBySAN(san))
+    assert ChessBook.polyglotKey(game_state) == key
+
+
+def test_move_codes():
+    game_state = ChessEngine.GameState()
+    game_state.loadFEN("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    for san, code in (("O-O", 0x0107), ("O-O-O", 0x0100), ("Kf1", 0x0105), ("Rb1", 0x0001)):
+        move = game_state.getMoveBySAN(san)
+        assert ChessBook.encodeMove(move) == code
+        assert ChessBook.decodeMove(game_state, code).moveID == move.moveID
+    game_state.loadFEN("8/P6k/8/8/8/8/8/K7 w - - 0 1")
+    assert ChessBook.encodeMove(game_state.getMoveBySAN("a8=Q")) == 0x4c38
+    assert ChessBook.decodeMove(game_state, 0x1c38) is None  # under-promotion to a knight
+
+
+def test_build_and_probe_book(tmp_path):
+    pgn_path = tmp_path / "games.pgn"
+    pgn_path.write_text('[Result "1-0"]\n\n1. e4 e5 2. Nf3 Nc6 1-0\n\n'
+                        '[Result "0-1"]\n\n1. e4 c5 2. Nf3 d6 0-1\n\n'
+                        '[Result "1/2-1/2"]\n\n1. d4 d5 1/2-1/2\n')
+    book_path = str(tmp_path / "games.bin")
+    ChessBook.buildBook(str(pgn_path), book_path, plies=2)
+    book = ChessBook.OpeningBook(book_path)
+    try:
+        game_state = ChessEngine.GameState()
+        assert sorted((move.getLongNotation(), weight) for move, weight in book.getMoves(game_state)) == \
+            [("d2d4", 1), ("e2e4", 2)]
+        game_state.makeMove(game_state.getMoveBySAN("e4"))
+        assert [move.getLongNotation() for move, weight in book.getMoves(game_state)] == ["c7c5"]  # e5 lost
+        game_state.makeMove(game_state.getMoveBySAN("c5"))
+        assert book.getMoves(game_state) == []  # only 2 plies of every game went in
+        assert book.pickMove(game_state) is None
+    finally:
+        book.close()
@@ -0,0 +1,114 @@
+"""
+Incremental Zobrist keys and the draw rules of the game state.
+"""
+import pytest
+import ChessBitboard
+import ChessEngine
+
+STATE_CLASSES = [ChessEngine.GameState, ChessBitboard.BitboardGameState]
+
+# castling both ways, en passant, promotions with and without a capture, captured and moved castling rooks
+GAMES = [("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+          ["e4", "d5", "e5", "f5", "exf6", "Nc6", "fxg7", "Bd7", "gxh8=Q", "e6", "Nf3", "Qe7", "Be2", "O-O-O", "O-O", "Kb8"]),
+         ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+          ["a3", "Bxe2", "Kxe2", "O-O", "Rhb1", "hxg2", "Qxf6", "g1=Q", "Qxe7", "Qxb1"])]
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+@pytest.mark.parametrize("fen, moves", GAMES)
+def test_zobrist_key_make_undo(fen, moves, state_class):
+    game_state = state_class()
+    game_state.loadFEN(fen)
+    keys = [game_state.zobrist_key]
+    for san in moves:
+        game_state.makeMove(game_state.getMoveBySAN(san))
+        assert game_state.zobrist_key == game_state.computeZobristKey()
+        keys.append(game_state.zobrist_key)
+    assert len(set(keys)) == len(keys)
+    while game_state.move_log:
+        game_state.undoMove()
+        keys.pop()
+        assert game_state.zobrist_key == keys[-1] == game_state.computeZobristKey()
+    assert game_state.getFEN() == fen
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+def test_zobrist_key_null_move(state_class):
+    game_state = state_class()
+    game_state.loadFEN("rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3")
+    key = game_state.zobrist_key
+    game_state.makeNullMove()
+    assert game_state.zobrist_key == game_state.computeZobristKey() != key
+    game_state.undoNullMove()
+    assert game_state.zobrist_key == key
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+def test_threefold_repetition(state_class):
+    game_state = state_class()
+    shuffle = ["Nf3", "Nf6", "Ng1", "Ng8"]
+    for san in shuffle:
+        game_state.makeMove(game_state.getMoveBySAN(san))
+    assert game_state.isRepetition()
+    assert not game_state.isRepetition(2)
+    game_state.getValidMoves()
+    assert game_state.draw_reason is None
+    for san in shuffle:
+        game_state.makeMove(game_state.getMoveBySAN(san))
+    assert game_state.isRepetition(2)
+    game_state.getValidMoves()
+    assert game_state.draw_reason == "threefold repetition"
+    game_state.undoMove()
+    assert game_state.drawReason() is None
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+def test_repetition_broken_by_pawn_move(state_class):
+    game_state = state_class()
+    for san in ["Nf3", "Nf6", "Ng1", "Ng8", "e3", "e6", "Nf3", "Nf6", "Ng1", "Ng8"]:
+        game_state.makeMove(game_state.getMoveBySAN(san))
+    assert game_state.isRepetition()
+    assert not game_state.isRepetition(2)  # the start position can't come back after e3 e6
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+def test_fifty_move_rule(state_class):
+    game_state = state_class()
+    game_state.loadFEN("8/8/4k3/8/8/3K4/8/7R w - - 99 80")
+    game_state.getValidMoves()
+    assert game_state.draw_reason is None
+    game_state.makeMove(game_state.getMoveBySAN("Rh2"))
+    assert game_state.halfmove_clock == 100
+    game_state.getValidMoves()
+    assert game_state.draw_reason == "fifty-move rule"
+    game_state.undoMove()
+    assert game_state.halfmove_clock == 99
+    game_state.makeMove(game_state.getMoveBySAN("Kc4"))
+    game_state.makeMove(game_state.getMoveBySAN("Kd6"))
+    assert game_state.drawReason() == "fifty-move rule"
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+def test_checkmate_on_fiftieth_move(state_class):
+    game_state = state_class()
+    game_state.loadFEN("6k1/5ppp/8/8/8/8/8/K3R3 w - - 99 80")
+    game_state.makeMove(game_state.getMoveBySAN("Re8#"))
+    game_state.getValidMoves()
+    assert game_state.checkmate
+    assert game_state.draw_reason is None
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+@pytest.mark.parametrize("fen", ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                                 "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1"])
+def test_staged_moves(fen, state_class):
+    game_state = state_class()
+    game_state.loadFEN(fen)
+    valid_moves = sorted(move.moveID for move in game_state.getValidMoves())
+    for hash_move_id in [None] + valid_moves:
+        moves = list(game_state.getStagedMoves(hash_move_id))
+        assert sorted(move.moveID for move in moves) == valid_moves
+        if hash_move_id is not None:
+            assert moves.pop(0).moveID == hash_move_id
+        quiet = [not (move.is_capture or move.is_pawn_promotion) for move in moves]
+        assert quiet == sorted(quiet)  # captures and promotions before quiet moves
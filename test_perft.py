@@ -0,0 +1,52 @@
+"""
+Perft counts of the standard positions with both move generators, and FEN round trips.
+"""
+import pytest
+import ChessBitboard
+import ChessEngine
+import ChessPerft
+
+STATE_CLASSES = [ChessEngine.GameState, ChessBitboard.BitboardGameState]
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+@pytest.mark.parametrize("name", sorted(ChessPerft.POSITIONS))
+def test_perft(name, state_class):
+    fen, counts = ChessPerft.POSITIONS[name]
+    game_state = state_class()
+    game_state.loadFEN(fen)
+    for depth in range(1, ChessPerft.DEFAULT_DEPTH + 1):
+        assert ChessPerft.perft(game_state, depth) == counts[depth - 1]
+    assert game_state.getFEN() == fen  # perft leaves the position as it found it
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+@pytest.mark.parametrize("fen, legal_moves, enpassant", [
+    ("8/8/2pp4/1P5r/KR2Pp1k/8/6P1/8 b - e3 0 1", 16, None),  # fxe3 would open the rank to the rook on b4
+    ("8/8/8/5k2/3pP3/8/8/4K3 b - e3 0 1", 9, "d4e3"),  # takes the pawn that gives check
+    ("8/8/8/2k5/3Pp3/8/8/4K3 b - d3 0 1", 9, "e4d3")])
+def test_enpassant_legality(fen, legal_moves, enpassant, state_class):
+    game_state = state_class()
+    game_state.loadFEN(fen)
+    moves = game_state.getValidMoves()
+    assert len(moves) == legal_moves
+    assert [move.getLongNotation() for move in moves if move.is_enpassant_move] == ([enpassant] if enpassant else [])
+
+
+@pytest.mark.parametrize("state_class", STATE_CLASSES, ids=["mailbox", "bitboard"])
+@pytest.mark.parametrize("fen", [fen for fen, counts in ChessPerft.POSITIONS.values()] +
+                         ["rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+                          "8/8/8/8/8/8/8/K1k5 b - - 57 90"])
+def test_fen_round_trip(fen, state_class):
+    game_state = state_class()
+    game_state.loadFEN(fen)
+    assert game_state.getFEN() == fen
+
+
+@pytest.mark.parametrize("fen", ["rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQQBNR w KQkq - 0 1",  # no white king
+                                 "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQxq - 0 1",  # bad castling
+                                 "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e4 0 1",  # bad en passant
+                                 "8/8/8/8/8/8/8/K1k4R w - - 0 1"])  # black is in check with white to move
+def test_invalid_fen(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.GameState().loadFEN(fen)